@@ -0,0 +1,515 @@
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from urllib.parse import parse_qsl
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.url import make_url
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, abort
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+from flaskr import (
+    QUESTION_ORDER,
+    QUESTIONS_PER_PAGE,
+    create_app,
+    page_window,
+    snapshot_page,
+    split_page,
+)
+from instrumentation import RequestStats
+from models import Question, category_cache, data_version, db, question_counts
+from queries import QUESTION_COLUMNS
+from snapshot import snapshots
+
+try:
+    import aiosqlite
+except ImportError:  # optional, only needed to serve SQLite through ASGI
+    aiosqlite = None
+
+try:
+    import asyncpg
+except ImportError:  # optional, only needed to serve PostgreSQL through ASGI
+    asyncpg = None
+
+
+"""
+ASGI entry point
+    create_asgi_app(test_config) serves the app built by create_app over
+    ASGI, e.g. with uvicorn:
+
+        uvicorn --factory asgi:create_asgi_app
+
+    The read endpoints that spend most of their time waiting on the
+    database are served natively: their statements are built from the same
+    SQLAlchemy expressions as the Flask views, compiled for the database's
+    dialect and awaited on an async driver (asyncpg or aiosqlite). A
+    request issues one statement, the page, and holds no thread while it
+    waits for it; nothing runs concurrently within a request. Every other route runs the
+    Flask app on a pool of ASGI_THREADS threads, request bodies buffered.
+
+    Like the views, the native routes take the categories and the question
+    totals from the in-process caches (category_cache, question_counts),
+    and serve everything from the snapshot file in snapshot mode, so only
+    the page itself is queried. They skip the other layers of the Flask
+    app: the page query always goes to the primary (no replica routing),
+    responses are not kept in the response cache, and the before/after
+    request hooks do not run.
+"""
+
+ERROR_MESSAGES = {
+    400: "bad request",
+    404: "resource not found",
+    405: "method not allowed",
+    422: "unprocessable",
+}
+
+
+def page_statement(args, where=None):
+    """The page query of paginate_questions as a Core statement."""
+    predicate, offset = page_window(args)
+    # the sort keys are labelled, select() would fold them into the
+    # question columns they repeat
+    statement = select(
+        list(QUESTION_COLUMNS) + [column.label(None) for column in QUESTION_ORDER]
+    )
+    if where is not None:
+        statement = statement.where(where)
+    if predicate is not None:
+        statement = statement.where(predicate)
+    return (
+        statement.order_by(*QUESTION_ORDER).offset(offset).limit(QUESTIONS_PER_PAGE + 1)
+    )
+
+
+"""
+AsyncDatabase
+    runs SQLAlchemy Core statements on an async driver. Subclasses set the
+    dialect the statements are compiled for and implement connect, close
+    and _fetch for their driver.
+"""
+
+
+class AsyncDatabase:
+    dialect = None
+
+    def __init__(self, url, config):
+        self.url = url
+        self.size = config["DB_POOL_SIZE"] + config["DB_MAX_OVERFLOW"]
+        self.config = config
+
+    def compile(self, statement):
+        compiled = statement.compile(dialect=self.dialect)
+        params = [compiled.params[name] for name in compiled.positiontup]
+        return str(compiled), params
+
+    async def fetch_all(self, statement, stats=None):
+        sql, params = self.compile(statement)
+        started = time.perf_counter()
+        rows = await self._fetch(sql, params)
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_seconds += time.perf_counter() - started
+        return rows
+
+
+class AiosqliteDatabase(AsyncDatabase):
+    dialect = sqlite.dialect()
+
+    async def connect(self):
+        self._connections = asyncio.Queue()
+        for _ in range(self.size):
+            connection = await aiosqlite.connect(
+                self.url.database,
+                timeout=self.config["DB_SQLITE_BUSY_TIMEOUT_MS"] / 1000,
+            )
+            await connection.execute("PRAGMA journal_mode=WAL")
+            self._connections.put_nowait(connection)
+
+    async def close(self):
+        while not self._connections.empty():
+            await self._connections.get_nowait().close()
+
+    async def _fetch(self, sql, params):
+        connection = await self._connections.get()
+        try:
+            async with connection.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._connections.put_nowait(connection)
+
+
+class AsyncpgDatabase(AsyncDatabase):
+    # :1, :2 ... placeholders, rewritten to asyncpg's $1, $2 ...
+    dialect = postgresql.dialect(paramstyle="numeric")
+
+    def compile(self, statement):
+        sql, params = super().compile(statement)
+        return re.sub(r"(?<!:):(\d+)", r"$\1", sql), params
+
+    async def connect(self):
+        server_settings = {}
+        if self.config["DB_STATEMENT_TIMEOUT_MS"]:
+            server_settings["statement_timeout"] = str(
+                self.config["DB_STATEMENT_TIMEOUT_MS"]
+            )
+        self._pool = await asyncpg.create_pool(
+            user=self.url.username,
+            password=self.url.password,
+            host=self.url.host,
+            port=self.url.port,
+            database=self.url.database,
+            min_size=1,
+            max_size=self.size,
+            server_settings=server_settings,
+        )
+
+    async def close(self):
+        await self._pool.close()
+
+    async def _fetch(self, sql, params):
+        return [tuple(row) for row in await self._pool.fetch(sql, *params)]
+
+
+def open_database(database_url, config):
+    url = make_url(database_url)
+    if url.drivername.startswith("sqlite"):
+        if url.database in (None, "", ":memory:"):
+            raise ValueError("an in-memory SQLite database cannot be served by ASGI")
+        if aiosqlite is None:
+            raise RuntimeError("serving SQLite through ASGI needs aiosqlite")
+        return AiosqliteDatabase(url, config)
+    if url.drivername.startswith("postgresql"):
+        if asyncpg is None:
+            raise RuntimeError("serving PostgreSQL through ASGI needs asyncpg")
+        return AsyncpgDatabase(url, config)
+    raise ValueError("no async driver for {!r}".format(url.drivername))
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin1")))
+        self.headers = {
+            name.decode("latin1").lower(): value.decode("latin1")
+            for name, value in scope["headers"]
+        }
+
+
+def wsgi_environ(scope, body):
+    """The PEP 3333 environ of an ASGI HTTP request with a buffered body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+"""
+TriviaASGI
+    the ASGI application: native handlers for the routes in NATIVE_ROUTES,
+    the Flask app on the thread pool for everything else. With native=False
+    every route goes to the Flask app, which is what the benchmark compares
+    against.
+"""
+
+
+class TriviaASGI:
+    # (method, path pattern, Flask rule for the metrics, handler name)
+    NATIVE_ROUTES = (
+        ("GET", re.compile(r"/categories"), "/categories", "_categories"),
+        ("GET", re.compile(r"/questions"), "/questions", "_questions"),
+        (
+            "GET",
+            re.compile(r"/categories/(\d+)/questions"),
+            "/categories/<int:cat_id>/questions",
+            "_category_questions",
+        ),
+    )
+
+    def __init__(self, app, database, threads=16, native=True):
+        self.app = app
+        self.database = database
+        self.native = native
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+        self.json_backend = app.extensions["json_backend"]
+        self.instrumentation = app.extensions["instrumentation"]
+        self._connected = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError("unsupported ASGI scope {!r}".format(scope["type"]))
+
+        await self._connect()
+        if self.native:
+            for method, pattern, rule, handler in self.NATIVE_ROUTES:
+                match = pattern.fullmatch(scope["path"])
+                if match and scope["method"] == method:
+                    request = Request(scope)
+                    return await self._native(
+                        request, send, rule, getattr(self, handler), *match.groups()
+                    )
+        return await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self._connect()
+                except Exception as error:
+                    await send(
+                        {"type": "lifespan.startup.failed", "message": str(error)}
+                    )
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._connected is not None and self._connected.done():
+                    await self.database.close()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _connect(self):
+        # the first request (or the lifespan startup) opens the connections
+        if self._connected is None:
+            self._connected = asyncio.ensure_future(self.database.connect())
+        await asyncio.shield(self._connected)
+
+    async def _native(self, request, send, rule, handler, *args):
+        stats = RequestStats()
+        etag = data_version.etag()
+        headers = [
+            (b"access-control-allow-origin", b"*"),
+            (b"etag", quote_etag(etag).encode()),
+            (
+                b"last-modified",
+                http_date(data_version.http_last_modified()).encode(),
+            ),
+        ]
+
+        if self._not_modified(request, etag):
+            status, body = 304, b""
+        else:
+            try:
+                status, payload = 200, await handler(request, stats, *args)
+            except HTTPException as error:
+                status = error.code
+                payload = {
+                    "success": False,
+                    "error": error.code,
+                    "message": ERROR_MESSAGES[error.code],
+                }
+                headers = headers[:1]
+            body = self.json_backend.encode(payload)
+            headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode()))
+
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+        self.instrumentation.record(
+            rule,
+            request.method,
+            status,
+            time.perf_counter() - stats.started,
+            stats,
+        )
+
+    @staticmethod
+    def _not_modified(request, etag):
+        # the same rules as flaskr.conditional
+        if "if-none-match" in request.headers:
+            return parse_etags(request.headers["if-none-match"]).contains(etag)
+        since = parse_date(request.headers.get("if-modified-since"))
+        return (
+            since is not None
+            and since.replace(tzinfo=timezone.utc).timestamp()
+            >= data_version.changed_after()
+        )
+
+    async def _cached(self, read):
+        """Call ``read`` on the in-process caches of the views. While they
+        are cold, loading them queries the database, which runs on the
+        thread pool so the event loop never waits on it."""
+        if question_counts.loaded and category_cache.loaded:
+            return read()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._read_in_app, read)
+
+    def _read_in_app(self, read):
+        with self.app.app_context():
+            try:
+                return read()
+            finally:
+                db.session.remove()
+
+    async def _categories(self, request, stats):
+        snapshot = snapshots.current()
+        if snapshot is not None:
+            categories = snapshot.categories
+        else:
+            categories = await self._cached(lambda: category_cache.get().categories)
+        if not categories:
+            abort(404)
+        return {
+            "success": True,
+            "categories": categories,
+            "total_categories": len(categories),
+        }
+
+    async def _listing(self, request, stats, cat_id=None):
+        """Page, next cursor, total and categories of the question listing
+        (of ``cat_id``); only the page is read from the database."""
+        snapshot = snapshots.current()
+        if snapshot is not None:
+            if cat_id is not None and cat_id not in snapshot.categories:
+                abort(404)
+            questions, next_cursor = snapshot_page(request, snapshot, cat_id)
+            return questions, next_cursor, snapshot.total(cat_id), snapshot.categories
+
+        categories, total = await self._cached(
+            lambda: (category_cache.get().categories, question_counts.total(cat_id))
+        )
+        # the category is checked against the cached categories, like the view
+        if cat_id is not None and cat_id not in categories:
+            abort(404)
+        where = None if cat_id is None else Question.category == cat_id
+        page = await self.database.fetch_all(page_statement(request.args, where), stats)
+        questions, next_cursor = split_page(page)
+        return questions, next_cursor, total, categories
+
+    async def _questions(self, request, stats):
+        current_questions, next_cursor, total, categories = await self._listing(
+            request, stats
+        )
+        if len(current_questions) == 0:
+            abort(404)
+        return {
+            "success": True,
+            "questions": current_questions,
+            "total_questions": total,
+            "current_category": None,
+            "categories": categories,
+            "next_cursor": next_cursor,
+        }
+
+    async def _category_questions(self, request, stats, cat_id):
+        # like the Flask view, every failure is answered with 422
+        try:
+            cat_id = int(cat_id)
+            category_question, next_cursor, total, _ = await self._listing(
+                request, stats, cat_id
+            )
+        except Exception:
+            abort(422)
+
+        return {
+            "success": True,
+            "questions": category_question,
+            "total_questions": total,
+            "next_cursor": next_cursor,
+        }
+
+    async def _wsgi(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        loop = asyncio.get_running_loop()
+        # the Flask app runs and is iterated on one thread, streamed
+        # responses keep their request context; None ends the response
+        chunks = asyncio.Queue(maxsize=8)
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(
+                {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": [
+                        (name.lower().encode("latin1"), value.encode("latin1"))
+                        for name, value in headers
+                    ],
+                }
+            )
+
+        def run():
+            try:
+                response = self.app(wsgi_environ(scope, bytes(body)), start_response)
+                try:
+                    for chunk in response:
+                        if chunk:
+                            put(
+                                {
+                                    "type": "http.response.body",
+                                    "body": chunk,
+                                    "more_body": True,
+                                }
+                            )
+                finally:
+                    if hasattr(response, "close"):
+                        response.close()
+            finally:
+                put(None)
+
+        finished = loop.run_in_executor(self.executor, run)
+        started = False
+        while True:
+            message = await chunks.get()
+            if message is None:
+                break
+            started = True
+            await send(message)
+        if not started:
+            await send({"type": "http.response.start", "status": 500, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        await finished
+
+
+def create_asgi_app(test_config=None):
+    app = create_app(test_config)
+    database = open_database(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+    return TriviaASGI(
+        app,
+        database,
+        threads=app.config.get("ASGI_THREADS", 16),
+        native=app.config.get("ASGI_NATIVE_ROUTES", True),
+    )
@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, request
+from werkzeug.test import EnvironBuilder
+
+from models import db
+
+# most sub-requests one POST /batch may carry
+MAX_BATCH_REQUESTS = 20
+BATCH_METHODS = ("GET", "POST")
+# headers of the batch request that are not passed on to its sub-requests
+BODY_HEADERS = ("Content-Type", "Content-Length")
+
+
+def parse_batch(body):
+    """Validate the sub-requests of a /batch body.
+
+    Returns a list of (method, path, json body or None, headers); raises
+    ValueError when the body is not a list of at most MAX_BATCH_REQUESTS
+    GET or POST requests for other routes than /batch.
+    """
+    items = body.get("requests") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_REQUESTS:
+        raise ValueError(
+            "requests must be a list of 1 to {} items".format(MAX_BATCH_REQUESTS)
+        )
+
+    batch = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("every request must be an object")
+        method = str(item.get("method", "GET")).upper()
+        path = item.get("path")
+        headers = item.get("headers") or {}
+        if method not in BATCH_METHODS:
+            raise ValueError("unsupported method {}".format(method))
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError("every request needs an absolute path")
+        if path.split("?", 1)[0].rstrip("/") == "/batch":
+            raise ValueError("batches can not be nested")
+        if not isinstance(headers, dict):
+            raise ValueError("headers must be an object")
+        batch.append((method, path, item.get("body"), headers))
+    return batch
+
+
+"""
+BatchDispatcher
+    runs the sub-requests of POST /batch through the app's own dispatch
+    (before/after request hooks, decorators, error handlers), so each one
+    answers exactly like its route would, without another HTTP round trip.
+
+    By default the sub-requests run one after the other in the batch's
+    application context and share its database session. With
+    "parallel": true they run on a pool of BATCH_THREADS threads; a
+    session can not be shared between threads, so each thread then uses
+    its own.
+"""
+
+
+class BatchDispatcher:
+    def __init__(self, app, threads=4):
+        self.app = app
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _pool(self):
+        # the pool's threads do not survive a fork, each worker makes its own
+        with self._lock:
+            if self._executor_pid != os.getpid():
+                self._executor_pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    self.threads, thread_name_prefix="batch"
+                )
+            return self._executor
+
+    def _environ(self, method, path, body, headers):
+        # sub-requests carry the batch's cookies and credentials
+        inherited = {
+            name: value
+            for name, value in request.headers.items()
+            if name not in BODY_HEADERS
+        }
+        inherited.update(headers)
+        builder = EnvironBuilder(
+            path=path,
+            method=method,
+            json=body if method == "POST" else None,
+            headers=inherited,
+            base_url=request.host_url,
+        )
+        try:
+            return builder.get_environ()
+        finally:
+            builder.close()
+
+    def _dispatch(self, environ):
+        """Run one sub-request in the current application context.
+
+        The sub-request gets its own flask.g on top of the batch's (request
+        stats, replica choice), which is restored afterwards; only the mark
+        of a write is kept. A sub-request that fails rolls the shared
+        session back, so the ones after it do not find it in a failed
+        transaction.
+        """
+        outer = dict(g.__dict__)
+        response = None
+        try:
+            with self.app.request_context(environ):
+                response = self.app.full_dispatch_request()
+                data = response.get_data()
+        except Exception:
+            self.app.log_exception(sys.exc_info())
+            return {"status": 500, "body": None}
+        finally:
+            if response is None or response.status_code >= 400:
+                db.session.rollback()
+            wrote = g.get("wrote_primary", False)
+            g.__dict__.clear()
+            g.__dict__.update(outer)
+            if wrote:
+                g.wrote_primary = True
+
+        if response.is_json:
+            body = json.loads(data) if data else None
+        else:
+            body = data.decode(response.charset or "utf-8")
+        return {"status": response.status_code, "body": body}
+
+    def _dispatch_alone(self, environ):
+        with self.app.app_context():
+            try:
+                return self._dispatch(environ), g.get("wrote_primary", False)
+            finally:
+                db.session.remove()
+
+    def run(self, batch, parallel=False):
+        environs = [self._environ(*item) for item in batch]
+        if not parallel or self.threads < 1 or len(environs) == 1:
+            return [self._dispatch(environ) for environ in environs]
+
+        results = []
+        for result, wrote in self._pool().map(self._dispatch_alone, environs):
+            # a write on a pool thread still marks this client as a writer
+            if wrote:
+                g.wrote_primary = True
+            results.append(result)
+        return results
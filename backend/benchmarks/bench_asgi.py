@@ -0,0 +1,181 @@
+"""Throughput of the ASGI entry point under high concurrency with slow queries.
+
+The same app is served by uvicorn twice: once with every route running the
+Flask app on the ASGI_THREADS thread pool (what a threaded WSGI worker does)
+and once with the native async read routes. Every SQL statement is delayed
+by --latency-ms, sleeping in the sync engine and awaiting in the async
+driver, to stand in for a database across the network. --concurrency
+keep-alive clients then read question pages and category listings.
+
+    python -m benchmarks.bench_asgi --concurrency 200 --latency-ms 20
+
+Needs uvicorn and aiosqlite (or asyncpg with --database-url).
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from asgi import TriviaASGI, open_database
+
+from benchmarks.common import make_app, seed_questions, summarize
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def add_latency(database, seconds):
+    """Delay every statement of the sync engine and of ``database``."""
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def sleep(*args):
+        time.sleep(seconds)
+
+    fetch = database._fetch
+
+    async def slow_fetch(sql, params):
+        await asyncio.sleep(seconds)
+        return await fetch(sql, params)
+
+    database._fetch = slow_fetch
+
+
+async def client(port, paths, samples, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for path in paths:
+        started = time.perf_counter()
+        writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(path).encode())
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        samples.append(time.perf_counter() - started)
+        errors[0] += status >= 400
+    writer.close()
+
+
+async def load(port, paths, concurrency):
+    samples, errors = [], [0]
+    per_client = [paths[index::concurrency] for index in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(client(port, chunk, samples, errors) for chunk in per_client)
+    )
+    return samples, errors[0], time.perf_counter() - started
+
+
+def run_load(port, paths, concurrency):
+    return asyncio.run(load(port, paths, concurrency))
+
+
+def serve(asgi_app, port):
+    server = uvicorn.Server(
+        uvicorn.Config(
+            asgi_app,
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+            backlog=4096,
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if uvicorn is None:
+        parser.error("the benchmark needs uvicorn")
+
+    # the response cache would answer repeated pages without the database
+    app = make_app(args.database_url, RESPONSE_CACHE_ENTRIES=0)
+    with app.app_context():
+        seed_questions(args.rows, args.seed)
+    rng = random.Random(args.seed)
+    pages = max(1, args.rows // 10)
+    paths = [
+        rng.choice(
+            [
+                "/questions?page={}".format(rng.randint(1, pages)),
+                "/categories/{}/questions".format(rng.randint(1, 6)),
+            ]
+        )
+        for _ in range(args.requests)
+    ]
+
+    database = open_database(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
+    add_latency(database, args.latency_ms / 1000)
+
+    print(
+        "{} requests, {} clients, {} ms per statement, {} threads".format(
+            args.requests, args.concurrency, args.latency_ms, args.threads
+        )
+    )
+    print(
+        "{:<28} {:>10} {:>9} {:>9} {:>9} {:>7}".format(
+            "mode", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"
+        )
+    )
+    for name, native in (("flask on thread pool", False), ("native async reads", True)):
+        asgi_app = TriviaASGI(app, database, threads=args.threads, native=native)
+        port = free_port()
+        server, thread = serve(asgi_app, port)
+        # the clients run in their own process so they do not compete with
+        # the server for the GIL; the first round warms caches and connections
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as clients:
+            clients.submit(
+                run_load, port, paths[: args.concurrency], args.concurrency
+            ).result()
+            samples, errors, elapsed = clients.submit(
+                run_load, port, paths, args.concurrency
+            ).result()
+        server.should_exit = True
+        thread.join()
+
+        summary = summarize(samples)
+        print(
+            "{:<28} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}".format(
+                name,
+                len(samples) / elapsed,
+                summary["p50_ms"],
+                summary["p95_ms"],
+                summary["p99_ms"],
+                errors,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
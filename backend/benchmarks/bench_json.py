@@ -0,0 +1,67 @@
+"""Per-endpoint comparison of the stdlib and orjson response encoders.
+
+Every endpoint is called through the Flask test client with the response
+cache disabled, once with JSON_BACKEND="stdlib" and once with "orjson",
+so the difference is the encoding share of each request.
+"""
+
+from flaskr import create_app
+from json_backend import orjson
+
+from benchmarks.common import (
+    make_app,
+    measure,
+    parse_args,
+    print_table,
+    seed_questions,
+    summarize,
+)
+
+ENDPOINTS = [
+    ("GET", "/categories", None),
+    ("GET", "/questions?page=1", None),
+    ("GET", "/questions?page=50", None),
+    ("GET", "/categories/3/questions", None),
+    ("POST", "/questions/search", {"searchTerm": "capital"}),
+    ("POST", "/quizzes", {"previous_questions": [], "quiz_category": {"id": 0}}),
+    ("GET", "/questions/export?category=3", None),
+]
+
+
+def call(client, method, url, body):
+    response = client.open(url, method=method, json=body)
+    response.get_data()
+    assert response.status_code == 200, (url, response.status_code)
+
+
+def main():
+    args = parse_args(__doc__, rows=20000, repeat=50)
+    if orjson is None:
+        raise SystemExit("orjson is not installed")
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        seed_questions(args.rows, args.seed)
+    database_url = app.config["SQLALCHEMY_DATABASE_URI"]
+
+    results = []
+    for backend in ("stdlib", "orjson"):
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": database_url,
+                "JSON_BACKEND": backend,
+                "RESPONSE_CACHE_ENTRIES": 0,
+            }
+        )
+        client = app.test_client()
+        for method, url, body in ENDPOINTS:
+            call(client, method, url, body)
+            samples = measure(lambda: call(client, method, url, body), args.repeat)
+            results.append(("{:<7}{} {}".format(backend, method, url), samples))
+
+    print("{} questions".format(args.rows))
+    print_table([(name, summarize(samples)) for name, samples in results])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Query plans and timings of the hot question queries without and with
+the question indexes (migrations 8a41e7c05d2f, c52e9b7f3a18 and
+d7e3a9c1f524).
+
+The indexes are dropped for the "before" run and created again for the
+"after" run, so run this against a scratch database only.
+"""
+
+from sqlalchemy import tuple_
+
+from flaskr import QUESTION_ORDER
+from models import db, Question
+
+from benchmarks.common import (
+    make_app,
+    measure,
+    parse_args,
+    print_table,
+    seed_questions,
+    summarize,
+)
+
+ORDER = QUESTION_ORDER
+
+
+def hot_queries(rows):
+    # the cursor of a page in the middle of the bank
+    middle = db.session.query(*ORDER).order_by(*ORDER).offset(rows // 2).first()
+    return {
+        "questions page 1": Question.query.order_by(*ORDER).limit(11),
+        "questions by cursor": Question.query.filter(tuple_(*ORDER) > tuple_(*middle))
+        .order_by(*ORDER)
+        .limit(11),
+        "category page 1": Question.query.filter(Question.category == 3)
+        .order_by(*ORDER)
+        .limit(11),
+        "category count": db.session.query(Question.id).filter(Question.category == 3),
+    }
+
+
+def explain(query):
+    statement = str(
+        query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+    if db.engine.dialect.name == "sqlite":
+        rows = db.session.execute("EXPLAIN QUERY PLAN " + statement)
+        return "\n".join("  " + row[-1] for row in rows)
+    rows = db.session.execute("EXPLAIN " + statement)
+    return "\n".join("  " + row[0] for row in rows)
+
+
+def run(label, rows, repeat):
+    results = []
+    for name, query in hot_queries(rows).items():
+        print("{} / {}:\n{}".format(label, name, explain(query)))
+        results.append(
+            ("{} {}".format(label, name), summarize(measure(query.all, repeat)))
+        )
+    return results
+
+
+def main():
+    args = parse_args(__doc__, rows=100000)
+    app = make_app(args.database_url)
+    with app.app_context():
+        seed_questions(args.rows, args.seed)
+        indexes = list(Question.__table__.indexes)
+
+        db.session.commit()
+        for index in indexes:
+            index.drop(db.engine)
+        results = run("before", args.rows, args.repeat)
+
+        db.session.commit()
+        for index in indexes:
+            index.create(db.engine)
+        results += run("after", args.rows, args.repeat)
+
+    print("{} questions".format(args.rows))
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare full ORM hydration with the column-projection read layer.
+
+For a list page and for a large read, the ORM case loads Question
+instances and calls format(); the projection case selects the columns
+through queries.question_rows() and zips the row tuples. Both time and
+peak traced memory per call are reported.
+"""
+
+import tracemalloc
+
+from flaskr import QUESTION_ORDER
+from models import db, Question
+from queries import format_question, question_rows
+
+from benchmarks.common import (
+    make_app,
+    measure,
+    parse_args,
+    print_table,
+    seed_questions,
+    summarize,
+)
+
+ORDER = QUESTION_ORDER
+
+
+def orm_read(limit):
+    questions = Question.query.order_by(*ORDER).limit(limit).all()
+    result = [question.format() for question in questions]
+    db.session.remove()
+    return result
+
+
+def projected_read(limit):
+    rows = question_rows(Question.query).order_by(*ORDER).limit(limit).all()
+    result = [format_question(row) for row in rows]
+    db.session.remove()
+    return result
+
+
+def peak_kib(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    args = parse_args(__doc__, rows=50000)
+    app = make_app(args.database_url)
+    results = []
+    memory = []
+    with app.app_context():
+        seed_questions(args.rows, args.seed)
+        for limit in (10, 1000, args.rows):
+            for name, read in (("orm", orm_read), ("projection", projected_read)):
+                label = "{} {} rows".format(name, limit)
+                results.append((label, measure(lambda: read(limit), args.repeat)))
+                memory.append((label, peak_kib(lambda: read(limit))))
+
+    print("{} questions".format(args.rows))
+    print_table([(name, summarize(samples)) for name, samples in results])
+    print()
+    for label, kib in memory:
+        print("{:<44} {:>10.1f} KiB peak".format(label, kib))
+
+
+if __name__ == "__main__":
+    main()
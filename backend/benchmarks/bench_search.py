@@ -0,0 +1,66 @@
+"""Compare /questions/search against the previous ILIKE implementation.
+
+The legacy case loads every matching row with DISTINCT ON/ILIKE, formats
+them all and slices one page, as search_question used to. The indexed case
+goes through search_questions() and the database-side pagination.
+"""
+
+from flaskr import paginate_questions
+from models import Question
+from search import search_questions
+
+from benchmarks.common import (
+    make_app,
+    measure,
+    parse_args,
+    print_table,
+    seed_questions,
+    summarize,
+)
+
+TERMS = ["india", "capital", "oscar novel", "zzz"]
+
+
+def legacy_search(term):
+    selection = (
+        Question.query.distinct(Question.question)
+        .filter(Question.question.ilike("%{}%".format(term)))
+        .all()
+    )
+    questions = [question.format() for question in selection]
+    return questions[:10], len(selection)
+
+
+def indexed_search(request, term):
+    selection, order_by, total = search_questions(term)
+    questions, _ = paginate_questions(request, selection, order_by=order_by)
+    return questions, total
+
+
+def main():
+    args = parse_args(__doc__, rows=100000)
+    app = make_app(args.database_url)
+    results = []
+    with app.test_request_context("/questions/search?page=1") as context:
+        seed_questions(args.rows, args.seed)
+        # build the in-process index once, as the first request would
+        indexed_search(context.request, TERMS[0])
+        for term in TERMS:
+            results.append(
+                (
+                    "ilike  {!r}".format(term),
+                    measure(lambda: legacy_search(term), args.repeat),
+                )
+            )
+            results.append(
+                (
+                    "index  {!r}".format(term),
+                    measure(lambda: indexed_search(context.request, term), args.repeat),
+                )
+            )
+    print("{} questions".format(args.rows))
+    print_table([(name, summarize(samples)) for name, samples in results])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Write throughput of POST /questions and DELETE /questions with and
+without group commit.
+
+--concurrency threads, standing in for the threads of a threaded worker,
+each create --writes questions through the test client and then delete
+them again. The run is repeated with WRITE_BATCH_ENABLED off and on for
+every --windows value (in milliseconds).
+
+    python -m benchmarks.bench_write_batching --concurrency 32 --writes 50
+
+By default every run writes to a fresh SQLite file; with --database-url all
+runs share that database.
+"""
+
+import argparse
+import threading
+import time
+
+from benchmarks.common import make_app, seed_questions, summarize
+
+
+def run(app, concurrency, writes):
+    samples = {"create": [], "delete": []}
+    errors = [0]
+    start = threading.Barrier(concurrency + 1)
+
+    def author(number):
+        client = app.test_client()
+        created = []
+        start.wait()
+        for index in range(writes):
+            started = time.perf_counter()
+            res = client.post(
+                "/questions",
+                json={
+                    "question": "Benchmark question {}-{}?".format(number, index),
+                    "answer": "yes",
+                    "category": 1 + index % 6,
+                    "difficulty": 1 + index % 5,
+                },
+            )
+            samples["create"].append(time.perf_counter() - started)
+            if res.status_code != 200:
+                errors[0] += 1
+                continue
+            created.append(res.get_json()["created"])
+        for question_id in created:
+            started = time.perf_counter()
+            res = client.delete("/questions/{}".format(question_id))
+            samples["delete"].append(time.perf_counter() - started)
+            errors[0] += res.status_code != 200
+
+    threads = [
+        threading.Thread(target=author, args=(number,)) for number in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, errors[0], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--writes", type=int, default=50)
+    parser.add_argument("--windows", default="1,2,5")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    modes = [("one commit per write", {"WRITE_BATCH_ENABLED": False})] + [
+        (
+            "group commit, {} ms window".format(window),
+            {
+                "WRITE_BATCH_ENABLED": True,
+                "WRITE_BATCH_WINDOW_MS": float(window),
+                "WRITE_BATCH_MAX": args.max_batch,
+            },
+        )
+        for window in args.windows.split(",")
+    ]
+
+    print(
+        "{} threads x {} creates and deletes, {} rows".format(
+            args.concurrency, args.writes, args.rows
+        )
+    )
+    print(
+        "{:<30} {:>10} {:>13} {:>13} {:>13} {:>7}".format(
+            "mode", "writes/s", "create p50", "create p95", "delete p95", "errors"
+        )
+    )
+    seeded = False
+    for name, config in modes:
+        # a pool large enough for every thread, so the runs only differ in
+        # how the writes are committed
+        app = make_app(
+            args.database_url,
+            DB_POOL_SIZE=args.concurrency + 1,
+            RESPONSE_CACHE_ENTRIES=0,
+            SLOW_REQUEST_MS=60000,
+            **config
+        )
+        if args.database_url is None or not seeded:
+            with app.app_context():
+                seed_questions(args.rows, args.seed)
+            seeded = True
+        # load the cached totals before the clock starts
+        app.test_client().get("/questions")
+
+        samples, errors, elapsed = run(app, args.concurrency, args.writes)
+        create = summarize(samples["create"])
+        delete = summarize(samples["delete"])
+        print(
+            "{:<30} {:>10.1f} {:>10.2f} ms {:>10.2f} ms {:>10.2f} ms {:>7}".format(
+                name,
+                (create["count"] + delete["count"]) / elapsed,
+                create["p50_ms"],
+                create["p95_ms"],
+                delete["p95_ms"],
+                errors,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Helpers shared by the benchmark scripts.
+
+Run the benchmarks from the backend directory, for example:
+
+    python -m benchmarks.bench_search --rows 100000
+
+By default they seed a throwaway SQLite database; pass --database-url to
+run against PostgreSQL instead (the tables are seeded, not reset, except
+by load_test which empties the questions before every bank size).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flaskr import create_app
+from models import db, data_version, question_counts, Question, Category
+from search import question_index, question_prefixes
+
+CATEGORIES = ["Science", "Art", "Geography", "History", "Entertainment", "Sports"]
+WORDS = (
+    "what which who where when title country river painter author capital "
+    "planet element team player movie album year ocean mountain king queen "
+    "war treaty invented discovered largest smallest first last famous india "
+    "africa europe heart brain atom star moon goal cup oscar novel poem"
+).split()
+
+
+def parse_args(description, **defaults):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--rows", type=int, default=defaults.get("rows", 10000))
+    parser.add_argument("--repeat", type=int, default=defaults.get("repeat", 20))
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def make_app(database_url=None, **config):
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="trivia-bench-"), "trivia.db")
+        database_url = "sqlite:///{}".format(path)
+    config["SQLALCHEMY_DATABASE_URI"] = database_url
+    return create_app(config)
+
+
+def seed_questions(rows, seed=0, batch_size=5000):
+    """Insert the six categories and ``rows`` synthetic questions.
+
+    Must be called inside an application context.
+    """
+    rng = random.Random(seed)
+    if not Category.query.count():
+        db.session.execute(
+            Category.__table__.insert(), [{"type": name} for name in CATEGORIES]
+        )
+    for start in range(0, rows, batch_size):
+        batch = [
+            {
+                "question": " ".join(
+                    rng.choice(WORDS) for _ in range(rng.randint(5, 12))
+                )
+                + "?",
+                "answer": rng.choice(WORDS),
+                "category": rng.randint(1, len(CATEGORIES)),
+                "difficulty": rng.randint(1, 5),
+            }
+            for _ in range(min(batch_size, rows - start))
+        ]
+        db.session.execute(Question.__table__.insert(), batch)
+    db.session.commit()
+    # the rows bypassed the mapper events, rebuild the index on first use
+    question_prefixes.reset()
+
+
+def clear_questions():
+    """Delete every question, so the next seed_questions() sets the size.
+
+    Must be called inside an application context.
+    """
+    db.session.execute(Question.__table__.delete())
+    db.session.commit()
+    # the delete bypassed the mapper events, as seed_questions() does
+    question_counts.reset()
+    question_index.reset()
+    question_prefixes.reset()
+    data_version.bump()
+
+
+def measure(fn, repeat):
+    """Call ``fn`` ``repeat`` times and return the timings in seconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def print_table(rows):
+    print("{:<44} {:>10} {:>10} {:>10}".format("case", "mean ms", "p50 ms", "max ms"))
+    for name, summary in rows:
+        print(
+            "{:<44} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                name, summary["mean_ms"], summary["p50_ms"], summary["max_ms"]
+            )
+        )
@@ -0,0 +1,71 @@
+"""Compare two load test result files.
+
+    python -m benchmarks.compare results/load-old.json results/load-new.json
+
+Prints throughput and p95/p99 per endpoint side by side with the relative
+change; latency increases and throughput drops beyond --threshold percent
+are flagged, and the exit status is 1 if any were.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as handle:
+        document = json.load(handle)
+    results = {
+        (row["rows"], row["mode"], row["endpoint"]): row for row in document["results"]
+    }
+    return document.get("commit", path), results
+
+
+def change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    baseline_commit, baseline = load(args.baseline)
+    candidate_commit, candidate = load(args.candidate)
+    print("{} -> {}".format(baseline_commit, candidate_commit))
+    print(
+        "{:>8} {:<7}{:<24} {:>12} {:>12} {:>12}".format(
+            "rows", "mode", "endpoint", "req/s", "p95 ms", "p99 ms"
+        )
+    )
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate)):
+        old, new = baseline[key], candidate[key]
+        changes = [
+            change(old["throughput_rps"], new["throughput_rps"]),
+            change(old["p95_ms"], new["p95_ms"]),
+            change(old["p99_ms"], new["p99_ms"]),
+        ]
+        flagged = (
+            changes[0] < -args.threshold
+            or changes[1] > args.threshold
+            or changes[2] > args.threshold
+        )
+        regressions += flagged
+        print(
+            "{:>8} {:<7}{:<24} {:>+11.1f}% {:>+11.1f}% {:>+11.1f}%{}".format(
+                *key, *changes, "  <-" if flagged else ""
+            )
+        )
+
+    for key in sorted(set(baseline) ^ set(candidate)):
+        print("{:>8} {:<7}{:<24} only in one run".format(*key))
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
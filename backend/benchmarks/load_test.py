@@ -0,0 +1,283 @@
+"""Load test every endpoint against synthetic question banks.
+
+For each bank size a fresh SQLite database is seeded (with --database-url
+the questions of that database are deleted and seeded again) and every
+route is driven, first through the Flask test client (in-process, no network) and
+then through a threaded HTTP server with concurrent keep-alive clients.
+Throughput and p50/p95/p99 latency per endpoint are printed and written as
+JSON, tagged with the git commit, so runs can be compared with
+benchmarks.compare:
+
+    python -m benchmarks.load_test --sizes 100,10000,100000 --requests 200
+    python -m benchmarks.compare results/old.json results/new.json
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import threading
+import time
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from models import db, Question
+
+from benchmarks.common import clear_questions, make_app, seed_questions, summarize
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class QuietHandler(WSGIRequestHandler):
+    # keep-alive connections for the HTTP load generator, no access log
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body go out in separate writes; without this Nagle's
+        # algorithm holds the body back until the client's delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def endpoints(rng, max_id, deletable):
+    """Return (name, method, url, body factory) for every route."""
+
+    def quiz_body():
+        previous = [rng.randint(1, max_id) for _ in range(5)]
+        return {"previous_questions": previous, "quiz_category": {"id": 0}}
+
+    def new_question():
+        return {
+            "question": "Load test question {}?".format(rng.random()),
+            "answer": "answer",
+            "category": rng.randint(1, 6),
+            "difficulty": rng.randint(1, 5),
+        }
+
+    deep_page = max(1, max_id // 10 // 2)
+    return [
+        ("categories", "GET", lambda: "/categories", None),
+        ("questions page 1", "GET", lambda: "/questions?page=1", None),
+        (
+            "questions deep page",
+            "GET",
+            lambda: "/questions?page={}".format(deep_page),
+            None,
+        ),
+        (
+            "questions by category",
+            "GET",
+            lambda: "/categories/{}/questions".format(rng.randint(1, 6)),
+            None,
+        ),
+        (
+            "search",
+            "POST",
+            lambda: "/questions/search",
+            lambda: {"searchTerm": rng.choice(["capital", "india", "oscar", "zzz"])},
+        ),
+        ("quizzes", "POST", lambda: "/quizzes", quiz_body),
+        ("create question", "POST", lambda: "/questions", new_question),
+        (
+            "delete question",
+            "DELETE",
+            lambda: "/questions/{}".format(deletable.pop()),
+            None,
+        ),
+    ]
+
+
+def run_client(app, endpoint, requests):
+    _, method, url, body = endpoint
+    client = app.test_client()
+    samples, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = client.open(url(), method=method, json=body() if body else None)
+        response.get_data()
+        samples.append(time.perf_counter() - request_started)
+        errors += response.status_code >= 400
+    return samples, errors, time.perf_counter() - started
+
+
+def run_http(port, endpoint, requests, concurrency):
+    _, method, url, body = endpoint
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    per_worker = [requests // concurrency] * concurrency
+    per_worker[0] += requests % concurrency
+
+    def worker(count):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        local = []
+        failed = 0
+        for _ in range(count):
+            with lock:
+                path = url()
+                payload = json.dumps(body()) if body else None
+            request_started = time.perf_counter()
+            connection.request(
+                method, path, body=payload, headers={"Content-Type": "application/json"}
+            )
+            response = connection.getresponse()
+            response.read()
+            local.append(time.perf_counter() - request_started)
+            failed += response.status >= 400
+        connection.close()
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in per_worker]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors[0], time.perf_counter() - started
+
+
+def result(size, mode, name, samples, errors, elapsed, concurrency):
+    summary = summarize(samples)
+    summary.update(
+        {
+            "rows": size,
+            "mode": mode,
+            "endpoint": name,
+            "concurrency": concurrency,
+            "errors": errors,
+            "throughput_rps": len(samples) / elapsed,
+        }
+    )
+    return summary
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", default="client,http")
+    parser.add_argument("--response-cache", action="store_true")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    modes = args.modes.split(",")
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        # the response cache would turn repeated reads into dictionary
+        # lookups, so it is off unless asked for
+        app = make_app(
+            args.database_url,
+            RESPONSE_CACHE_ENTRIES=1024 if args.response_cache else 0,
+        )
+        with app.app_context():
+            if args.database_url is not None:
+                # a shared database still holds the previous size's bank
+                clear_questions()
+            seed_questions(size, args.seed)
+        rng = random.Random(args.seed)
+
+        server = None
+        if "http" in modes:
+            server = make_server(
+                "127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        for mode in modes:
+            deletable = []
+            for endpoint in endpoints(rng, size, deletable):
+                requests = args.requests
+                if endpoint[0] == "delete question":
+                    # remove what the create endpoint just added; the bank
+                    # may hold fewer questions than --requests
+                    with app.app_context():
+                        deletable[:] = [
+                            question_id
+                            for (question_id,) in db.session.query(Question.id)
+                            .order_by(Question.id.desc())
+                            .limit(args.requests)
+                        ]
+                    requests = len(deletable)
+                    if not requests:
+                        continue
+                if mode == "client":
+                    samples, errors, elapsed = run_client(app, endpoint, requests)
+                    concurrency = 1
+                else:
+                    samples, errors, elapsed = run_http(
+                        server.server_port, endpoint, requests, args.concurrency
+                    )
+                    concurrency = args.concurrency
+                results.append(
+                    result(
+                        size, mode, endpoint[0], samples, errors, elapsed, concurrency
+                    )
+                )
+                print(
+                    "{:>8} {:<7}{:<24} {:>9.1f} req/s  p50 {:>7.2f}  p95 {:>7.2f}"
+                    "  p99 {:>7.2f} ms  errors {}".format(
+                        size,
+                        mode,
+                        endpoint[0],
+                        results[-1]["throughput_rps"],
+                        results[-1]["p50_ms"],
+                        results[-1]["p95_ms"],
+                        results[-1]["p99_ms"],
+                        errors,
+                    )
+                )
+
+        if server is not None:
+            server.shutdown()
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        "load-{}-{}.json".format(
+            commit, datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        ),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(
+            {
+                "commit": commit,
+                "created": datetime.datetime.utcnow().isoformat() + "Z",
+                "python": platform.python_version(),
+                "arguments": vars(args),
+                "results": results,
+            },
+            handle,
+            indent=2,
+        )
+    print("results written to {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
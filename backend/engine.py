@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+def _flag(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+# setting: (parser for the environment variable, default)
+DB_SETTINGS = {
+    "DB_POOL_SIZE": (int, 5),
+    "DB_MAX_OVERFLOW": (int, 10),
+    "DB_POOL_TIMEOUT": (float, 30),
+    "DB_POOL_RECYCLE": (int, 1800),
+    # a ping round trip on every checkout; only worth it when idle
+    # connections get dropped sooner than DB_POOL_RECYCLE (proxies,
+    # firewalls, database restarts)
+    "DB_POOL_PRE_PING": (_flag, False),
+    "DB_STATEMENT_TIMEOUT_MS": (int, None),
+    "DB_SQLITE_BUSY_TIMEOUT_MS": (int, 5000),
+    # space- or comma-separated URLs of read replicas, see replicas.py
+    "DB_REPLICA_URLS": (str, ""),
+    "DB_REPLICA_LAG_SECONDS": (float, 5),
+    # memory-mapped question bank file for the reads, see snapshot.py
+    "SNAPSHOT_PATH": (str, ""),
+    "SNAPSHOT_REFRESH_SECONDS": (float, 1),
+    "SNAPSHOT_REBUILD_DELAY": (float, 0.5),
+    # group commit of question writes, see write_batch.py
+    "WRITE_BATCH_ENABLED": (_flag, False),
+    "WRITE_BATCH_MAX": (int, 64),
+    "WRITE_BATCH_WINDOW_MS": (float, 2),
+}
+
+
+"""
+load_db_settings(config)
+    fills the DB_*, SNAPSHOT_* and WRITE_BATCH_* settings that create_app(test_config) did not set from
+    environment variables of the same name, and SQLALCHEMY_DATABASE_URI
+    from DATABASE_URL. A sqlite:/// URL runs the whole app on a local
+    SQLite file instead of PostgreSQL.
+"""
+
+
+def load_db_settings(config, environ=os.environ):
+    if "SQLALCHEMY_DATABASE_URI" not in config and environ.get("DATABASE_URL"):
+        config["SQLALCHEMY_DATABASE_URI"] = environ["DATABASE_URL"]
+
+    for name, (parse, default) in DB_SETTINGS.items():
+        if name in config:
+            continue
+        value = environ.get(name)
+        config[name] = default if value in (None, "") else parse(value)
+
+
+"""
+MeteredQueuePool
+    QueuePool that also records how often and how long callers waited for
+    a connection, for the per-worker pool statistics.
+"""
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._metrics_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self):
+        with self._metrics_lock:
+            return {
+                "pid": os.getpid(),
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+@event.listens_for(MeteredQueuePool, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets the stand-in database serve reads while a write is running;
+    # writers wait for each other up to the connect timeout
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+"""
+engine_options(database_url, config)
+    turns the DB_* settings into SQLALCHEMY_ENGINE_OPTIONS: a metered
+    QueuePool sized by DB_POOL_SIZE/DB_MAX_OVERFLOW, pre-ping and recycle,
+    and on PostgreSQL a server-side statement_timeout. In-memory SQLite
+    keeps Flask-SQLAlchemy's single shared connection.
+"""
+
+
+def engine_options(database_url, config):
+    url = make_url(database_url)
+    if url.drivername.startswith("sqlite") and url.database in (None, "", ":memory:"):
+        return {}
+
+    options = {
+        "poolclass": MeteredQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+
+    if url.drivername.startswith("sqlite"):
+        busy_timeout = config["DB_SQLITE_BUSY_TIMEOUT_MS"]
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": busy_timeout / 1000,
+        }
+    elif url.drivername.startswith("postgresql") and config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {
+            "options": "-c statement_timeout={:d}".format(
+                config["DB_STATEMENT_TIMEOUT_MS"]
+            )
+        }
+
+    return options
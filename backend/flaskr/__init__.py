@@ -1,32 +1,301 @@
 import os
+import base64
+import binascii
+import json
+import math
+from datetime import datetime, timezone
+from functools import wraps
 from unicodedata import category
-from flask import Flask, request, abort, jsonify
+from flask import (
+    Flask,
+    Response,
+    request,
+    abort,
+    make_response,
+    stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
 from flask_migrate import Migrate
-import random
-
-from models import setup_db, Question, Category
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import (
+    setup_db,
+    database_path,
+    db,
+    Question,
+    category_cache,
+    data_version,
+    question_counts,
+    sort_key,
+)
+from question_io import (
+    CSV_TYPES,
+    EXPORT_BATCH_SIZE,
+    IMPORT_BATCH_SIZE,
+    IMPORT_COMMIT_SIZE,
+    NDJSON_TYPES,
+    export_rows,
+    import_questions,
+    read_rows,
+)
+from batch import BatchDispatcher, parse_batch
+from engine import load_db_settings
+from instrumentation import Instrumentation
+from json_backend import dumps, init_json, jsonify
+from queries import (
+    QUESTION_FIELDS,
+    format_question,
+    get_question,
+    question_rows,
+)
+from quiz_sessions import QuizSessionStore
+from replicas import replicas
+from response_cache import ResponseCache
+from search import question_index, question_prefixes, search_questions
+from snapshot import snapshots
+from write_batch import write_batcher
 
 QUESTIONS_PER_PAGE = 10
+# most questions one /quizzes request can prefetch
+MAX_QUIZ_BATCH = 10
+# autocomplete suggestions returned by default and at most
+SUGGESTIONS_PER_REQUEST = 8
+MAX_SUGGESTIONS = 25
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Sort keys for the question listings, NULL-safe (see models.sort_key).
+# The trailing id makes every key unique, which keyset (cursor) pagination
+# relies on.
+QUESTION_ORDER = (
+    sort_key(Question.difficulty),
+    sort_key(Question.category),
+    Question.id,
+)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        abort(400)
+    # the sort keys are numbers; anything else was not made by encode_cursor
+    if not isinstance(values, list) or not all(
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+        for value in values
+    ):
+        abort(400)
+    return values
+
+
+def page_bounds(args, order_by=QUESTION_ORDER):
+    """Return the cursor values and the offset of the page ``args`` ask for.
+
+    ``?cursor=`` continues after the last row of the previous page (the
+    values are its sort keys, and the offset is 0), otherwise ``?page=`` is
+    turned into an offset and the values are None.
+    """
+    cursor = args.get("cursor", None)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(order_by):
+            abort(400)
+        return values, 0
+
+    page = args.get("page", 1, type=int)
+    if page < 1:
+        abort(400)
+    return None, (page - 1) * QUESTIONS_PER_PAGE
+
+
+def page_window(args, order_by=QUESTION_ORDER):
+    """Return the keyset predicate and the offset of the page ``args`` ask
+    for, see page_bounds."""
+    values, offset = page_bounds(args, order_by)
+    if values is None:
+        return None, offset
+    return tuple_(*order_by) > tuple_(*values), 0
+
+
+def split_page(rows, order_by=QUESTION_ORDER):
+    """Format the QUESTIONS_PER_PAGE + 1 rows of a page query, question
+    columns followed by the sort keys, into the page and the next cursor."""
+    width = len(QUESTION_FIELDS)
+    current_questions = [
+        format_question(row[:width]) for row in rows[:QUESTIONS_PER_PAGE]
+    ]
+
+    next_cursor = None
+    if len(rows) > QUESTIONS_PER_PAGE:
+        next_cursor = encode_cursor(list(rows[QUESTIONS_PER_PAGE - 1][width:]))
+
+    return current_questions, next_cursor
+
 
+def paginate_questions(request, selection, order_by=QUESTION_ORDER):
+    """Return one page of ``selection`` plus the cursor of the next page.
 
-def paginate_questions(request, selection):
-    # sourcery skip: inline-immediately-returned-variable
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    The page is cut in the database with the keyset predicate or the
+    LIMIT/OFFSET of page_window. Only the rows of the page are loaded.
+    """
+    predicate, offset = page_window(request.args, order_by)
+    selection = selection.order_by(*order_by)
+    if predicate is not None:
+        selection = selection.filter(predicate)
+    if offset:
+        selection = selection.offset(offset)
+
+    # fetch one extra row to know whether another page follows, together
+    # with the sort keys the next cursor is built from
+    rows = question_rows(selection, *order_by).limit(QUESTIONS_PER_PAGE + 1).all()
+    return split_page(rows, order_by)
+
+
+def snapshot_page(request, snapshot, category=None):
+    """paginate_questions for the question listing (of ``category``) served
+    from the question bank snapshot."""
+    values, offset = page_bounds(request.args)
+    rows = snapshot.page(category, values, offset, QUESTIONS_PER_PAGE + 1)
+    return split_page(rows)
+
+
+def random_questions(category, previous_questions, count=1):
+    """Pick up to ``count`` distinct random questions of ``category`` (None:
+    all categories) that are not in ``previous_questions``.
+
+    The ids are drawn from the in-process id arrays of question_counts, so
+    every question is equally likely, and fetched by primary key in one
+    query reading ``count`` rows, however large the bank. An id whose
+    question another worker deleted is left out and replaced by a new draw.
+    """
+    exclude = set(previous_questions)
+    picked = {}
+    while len(picked) < count:
+        ids = question_counts.sample(category, exclude, count - len(picked))
+        if not ids:
+            break
+        rows = question_rows(Question.query).filter(Question.id.in_(ids)).all()
+        found = {row[0]: format_question(row) for row in rows}
+        for question_id in ids:
+            exclude.add(question_id)
+            if question_id in found:
+                picked[question_id] = found[question_id]
+    return list(picked.values())
+
+
+def conditional(view):
+    """Answer conditional GETs from the data version before the view runs.
+
+    Responses carry an ETag and Last-Modified derived from data_version; a
+    request whose If-None-Match (or If-Modified-Since) is still current gets
+    an empty 304 without any query being run. The validators only follow
+    this process' writes, see DataVersion.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = data_version.etag()
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = (
+                since is not None
+                and since.replace(tzinfo=timezone.utc).timestamp()
+                >= data_version.changed_after()
+            )
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = datetime.fromtimestamp(
+            data_version.http_last_modified(), timezone.utc
+        )
+        return response
+
+    return wrapper
 
-    return current_questions
+
+def write_response(result):
+    """Acknowledge a write with the new question total.
+
+    The refreshed first page of questions is only added, through the usual
+    database-side pagination, when asked for with ?include_questions=true.
+    """
+    result["total_questions"] = question_counts.total()
+    if request.args.get("include_questions", "").lower() in ("1", "true", "yes"):
+        result["questions"], result["next_cursor"] = paginate_questions(
+            request, Question.query
+        )
+    return jsonify(result)
+
+
+def export_response(rows, fields, name):
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+
+    response = Response(
+        stream_with_context(export_rows(rows, fields, fmt, dumps=dumps)),
+        mimetype=EXPORT_FORMATS[fmt],
+    )
+    response.headers["Content-Disposition"] = "attachment; filename={}.{}".format(
+        name, fmt
+    )
+    return response
 
 
 def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    load_db_settings(app.config)
+    setup_db(app, app.config.get("SQLALCHEMY_DATABASE_URI", database_path))
+    replicas.init_app(app)
+    snapshots.init_app(app)
+    write_batcher.init_app(app)
+    init_json(app)
+    Migrate(app, db)
+    question_index.reset()
+    # The autocomplete index and the question id arrays are built at
+    # start-up so no request pays for them; without a questions table yet
+    # (before the migrations ran) they are built on first use instead
+    question_prefixes.reset()
+    with app.app_context():
+        try:
+            question_prefixes.load()
+            question_counts.load()
+        except SQLAlchemyError:
+            app.logger.warning("question indexes not built at start-up")
+        finally:
+            db.session.remove()
+    instrumentation = Instrumentation()
+    instrumentation.init_app(app)
+    response_cache = ResponseCache(
+        max_entries=app.config.get("RESPONSE_CACHE_ENTRIES", 1024),
+        max_bytes=app.config.get("RESPONSE_CACHE_BYTES", 16 * 1024 * 1024),
+        max_age=app.config.get("RESPONSE_CACHE_MAX_AGE", 5.0),
+    )
+    quiz_sessions = QuizSessionStore(
+        max_sessions=app.config.get("QUIZ_SESSIONS_MAX", 10000),
+        ttl=app.config.get("QUIZ_SESSION_TTL", 3600),
+        max_deck=app.config.get("QUIZ_DECK_MAX", 200),
+    )
+    batch_dispatcher = BatchDispatcher(app, threads=app.config.get("BATCH_THREADS", 4))
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -54,13 +323,18 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
 
     @app.route("/categories", methods=["GET"])
     @cross_origin()
+    @conditional
+    @replicas.read_only
     def retrieve_categories():
-        # Implement pagniation
-        categories = Category.query.all()
-        formatted_categories = {category.id: category.type for category in categories}
-
-        # If the query returns nothing for categories abort and show error 404
-        if len(categories) is None:
+        # Categories are served from the process-wide snapshot, or from the
+        # question bank snapshot file in snapshot mode
+        snapshot = snapshots.current()
+        formatted_categories = (
+            category_cache.get() if snapshot is None else snapshot
+        ).categories
+
+        # If there are no categories abort and show error 404
+        if not formatted_categories:
             abort(404)
 
         # return statement should state if the request is successful,
@@ -88,16 +362,20 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
 
     @app.route("/questions")
     @cross_origin()
+    @conditional
+    @response_cache.cached
+    @replicas.read_only
     def retrieve_questions():
-        # Implement pagniation
-        selection = (
-            Question.query.order_by(Question.difficulty)
-            .order_by(Question.category)
-            .all()
-        )
-        current_questions = paginate_questions(request, selection)
-        query_categories = Category.query.all()
-        categories = {category.id: category.type for category in query_categories}
+        # Implement pagniation, over the snapshot file in snapshot mode
+        snapshot = snapshots.current()
+        if snapshot is None:
+            current_questions, next_cursor = paginate_questions(request, Question.query)
+            total_questions = question_counts.total()
+            categories = category_cache.get().categories
+        else:
+            current_questions, next_cursor = snapshot_page(request, snapshot)
+            total_questions = snapshot.total()
+            categories = snapshot.categories
 
         # If no questions is found abort and show error 404
         if len(current_questions) == 0:
@@ -107,9 +385,10 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
             {
                 "success": True,
                 "questions": current_questions,
-                "total_questions": len(Question.query.all()),
+                "total_questions": total_questions,
                 "current_category": None,
                 "categories": categories,
+                "next_cursor": next_cursor,
             }
         )
 
@@ -125,30 +404,24 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
     @cross_origin()
     def delete_question(question_id):
         try:
-            # Get the question with the id from the Question table
-            question = Question.query.filter(Question.id == question_id).one_or_none()
+            if write_batcher.enabled:
+                # Queued for the next group commit, False if it does not exist
+                if not write_batcher.delete(question_id):
+                    abort(404)
+            else:
+                # Get the question with the id from the Question table
+                question = Question.query.filter(
+                    Question.id == question_id
+                ).one_or_none()
 
-            # If the question does not exist show error 404
-            if question is None:
-                abort(404)
+                # If the question does not exist show error 404
+                if question is None:
+                    abort(404)
 
-            # Otherwise delete selected question
-            question.delete()
-            selection = (
-                Question.query.order_by(Question.difficulty)
-                .order_by(Question.category)
-                .all()
-            )
-            current_questions = paginate_questions(request, selection)
+                # Otherwise delete selected question
+                question.delete()
 
-            return jsonify(
-                {
-                    "success": True,
-                    "deleted": question_id,
-                    "questions": current_questions,
-                    "total_questions": len(Question.query.all()),
-                }
-            )
+            return write_response({"success": True, "deleted": question_id})
         except Exception:
             abort(422)
 
@@ -175,33 +448,96 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
         new_difficulty = body.get("difficulty")
 
         try:
-            question = Question(
-                question=new_question,
-                answer=new_answer,
-                category=new_category,
-                difficulty=new_difficulty,
-            )
-            question.insert()
-
-            selection = (
-                Question.query.order_by(Question.difficulty)
-                .order_by(Question.category)
-                .all()
-            )
-            current_questions = paginate_questions(request, selection)
+            if write_batcher.enabled:
+                # Queued for the next group commit, which assigns the id
+                question_id = write_batcher.insert(
+                    question=new_question,
+                    answer=new_answer,
+                    category=new_category,
+                    difficulty=new_difficulty,
+                )
+            else:
+                question = Question(
+                    question=new_question,
+                    answer=new_answer,
+                    category=new_category,
+                    difficulty=new_difficulty,
+                )
+                question.insert()
+                question_id = question.id
 
-            return jsonify(
-                {
-                    "success": True,
-                    "created": question.id,
-                    "questions": current_questions,
-                    "total_questions": len(Question.query.all()),
-                }
-            )
+            return write_response({"success": True, "created": question_id})
 
         except:
             abort(422)
 
+    """
+    Bulk import: the request body is streamed as NDJSON (one question object
+    per line) or CSV with a question,answer,category,difficulty header.
+    Rows are validated as they are read and inserted in batches.
+    """
+
+    @app.route("/questions/import", methods=["POST"])
+    @cross_origin()
+    def import_question_bank():
+        content_type = request.mimetype
+        if content_type not in NDJSON_TYPES + CSV_TYPES:
+            abort(415)
+
+        summary = import_questions(
+            read_rows(request.stream, content_type),
+            category_cache.get().categories,
+            batch_size=app.config.get("IMPORT_BATCH_SIZE", IMPORT_BATCH_SIZE),
+            commit_size=app.config.get("IMPORT_COMMIT_SIZE", IMPORT_COMMIT_SIZE),
+        )
+        # The batched inserts bypass the model hooks, recount from scratch
+        question_counts.reset()
+        question_index.reset()
+        question_prefixes.reset()
+        data_version.bump()
+
+        return jsonify(
+            {
+                "success": True,
+                "imported": summary["imported"],
+                "failed": summary["failed"],
+                "errors": summary["errors"],
+            }
+        )
+
+    """
+    Export: streams the question bank as NDJSON or CSV (?format=csv). The
+    rows are read in batches from a server-side cursor and written out as
+    they arrive, so memory use does not depend on the size of the bank.
+    Questions can be filtered with ?category=, ?from_id= and ?to_id=.
+    """
+
+    @app.route("/questions/export")
+    @cross_origin()
+    @replicas.read_only
+    def export_questions():
+        selection = question_rows(Question.query)
+
+        category_id = request.args.get("category", None, type=int)
+        from_id = request.args.get("from_id", None, type=int)
+        to_id = request.args.get("to_id", None, type=int)
+        if category_id is not None:
+            selection = selection.filter(Question.category == category_id)
+        if from_id is not None:
+            selection = selection.filter(Question.id >= from_id)
+        if to_id is not None:
+            selection = selection.filter(Question.id <= to_id)
+
+        rows = selection.order_by(Question.id).yield_per(EXPORT_BATCH_SIZE)
+        return export_response(rows, QUESTION_FIELDS, "questions")
+
+    @app.route("/categories/export")
+    @cross_origin()
+    @replicas.read_only
+    def export_categories():
+        categories = category_cache.get().categories
+        return export_response(sorted(categories.items()), ("id", "type"), "categories")
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -215,31 +551,60 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
 
     @app.route("/questions/search", methods=["POST"])
     @cross_origin()
+    @response_cache.cached
+    @replicas.read_only
     def search_question():
         body = request.get_json()
         search = body.get("searchTerm", None)
 
         try:
-            # Get questions having the search term as part of their string
-            selection = (
-                Question.query.distinct(Question.question)
-                .filter(Question.question.ilike("%{}%".format(search)))
-                .all()
-            )
+            if search is None:
+                abort(422)
+
+            # Get questions having the search term as part of their string,
+            # best matches first
+            selection, order_by, total = search_questions(search)
             # paginate search_query
-            current_question = paginate_questions(request, selection)
+            current_question, next_cursor = paginate_questions(
+                request, selection, order_by=order_by
+            )
             # return search results
             return jsonify(
                 {
                     "success": True,
                     "questions": current_question,
                     "search_term": search,
-                    "total_questions": len(selection),
+                    "total_questions": total,
+                    "next_cursor": next_cursor,
                 }
             )
         except:
             abort(422)
 
+    """
+    Autocomplete: questions with a word starting with ``?prefix=``, served
+    from the in-memory prefix index on every keystroke without querying
+    the database.
+    """
+
+    @app.route("/questions/suggest")
+    @cross_origin()
+    def suggest_questions():
+        prefix = request.args.get("prefix", "").strip()
+        limit = request.args.get("limit", SUGGESTIONS_PER_REQUEST, type=int)
+
+        # An empty prefix or a limit out of range can not be served
+        if not prefix or not 1 <= limit <= MAX_SUGGESTIONS:
+            abort(422)
+
+        return jsonify(
+            {
+                "success": True,
+                "prefix": prefix,
+                "suggestions": question_prefixes.suggest(prefix, limit),
+            }
+        )
+
     """
     @TODO:
     Create a GET endpoint to get questions based on category.
@@ -251,24 +616,36 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
 
     @app.route("/categories/<int:cat_id>/questions")
     @cross_origin()
+    @conditional
+    @response_cache.cached
+    @replicas.read_only
     def questionsByCategory(cat_id):
         try:
-            # Get categories by their id
-            query_category = Category.query.filter(Category.id == cat_id).one_or_none()
-            if query_category is None:
-                abort(404)
-
-            selection = Question.query.join(
-                Category, Question.category == Category.id
-            ).filter(Question.category == cat_id)
-            # paginate selection
-            category_question = paginate_questions(request, selection)
+            snapshot = snapshots.current()
+            if snapshot is not None:
+                # Snapshot mode: the category and its page come from the file
+                if cat_id not in snapshot.categories:
+                    abort(404)
+                category_question, next_cursor = snapshot_page(
+                    request, snapshot, cat_id
+                )
+                total_questions = snapshot.total(cat_id)
+            else:
+                # Check the category exists against the cached categories
+                if cat_id not in category_cache.get().categories:
+                    abort(404)
+
+                selection = Question.query.filter(Question.category == cat_id)
+                # paginate selection
+                category_question, next_cursor = paginate_questions(request, selection)
+                total_questions = question_counts.total(cat_id)
             # return statement for questions in a category
             return jsonify(
                 {
                     "success": True,
                     "questions": category_question,
-                    "total_questions": len(selection.all()),
+                    "total_questions": total_questions,
+                    "next_cursor": next_cursor,
                 }
             )
         except Exception:
@@ -288,55 +665,174 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
 
     @app.route("/quizzes", methods=["POST"])
     @cross_origin()
+    @replicas.read_only
     def quiz_game():
 
         try:
             body = request.get_json()
             previous_questions = body.get("previous_questions", None)
             quiz_category = body.get("quiz_category", None)
+            # Number of unseen questions to return, to play several rounds per request
+            count = int(body.get("count", 1))
+            if not 1 <= count <= MAX_QUIZ_BATCH:
+                abort(422)
 
             # If previous_questions does not exist, create an empty list for previous_questions
             if previous_questions is None:
                 previous_questions = []
 
-            if quiz_category is None:
-                selection = Question.query.all()
-            # Get all questions not in previous questions if no category is selected
-            if quiz_category["id"] == 0:
-                selection = Question.query.filter(
-                    Question.id.notin_(previous_questions)
-                ).all()
-            # If Category is selected, get questions in that category that is not in previous questions
+            category_id = int(quiz_category["id"])
+            snapshot = snapshots.current()
+            if snapshot is not None:
+                # Snapshot mode samples the mapped file, without the database
+                questions = snapshot.sample(
+                    category_id or None, previous_questions, count
+                )
             else:
-                selection = (
-                    Question.query.filter(Question.category == quiz_category["id"])
-                    .filter(Question.id.notin_(previous_questions))
-                    .all()
+                # Questions from all categories if no category is selected,
+                # leaving out the previous questions
+                questions = random_questions(
+                    category_id or None, previous_questions, count
                 )
 
             # If all questions in same category are in previous_questions, question = None
-            if not selection:
-                question = None
+            if not questions:
                 return jsonify({"success": True})
-            else:
-                # This selects a question at random
-                random_question = random.choice(selection)
-
-            # format selected question
-            question = random_question.format()
 
-            return jsonify(
-                {
-                    "success": True,
-                    "quiz_category": quiz_category,
-                    "previous_questions": previous_questions,
-                    "question": question,
-                }
-            )
+            result = {
+                "success": True,
+                "quiz_category": quiz_category,
+                "previous_questions": previous_questions,
+                "question": questions[0],
+            }
+            # Prefetched questions, in the order they should be asked
+            if "count" in body:
+                result["questions"] = questions
+            return jsonify(result)
 
         except Exception:
             abort(422)
 
+    """
+    Quiz sessions keep the shuffled deck of question ids on the server, so
+    each next question is taken off the deck without resending the
+    questions already played.
+    """
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    @cross_origin()
+    def start_quiz_session():
+        body = request.get_json()
+        if body is None:
+            abort(400)
+        quiz_category = body.get("quiz_category", None)
+        try:
+            category_id = int(quiz_category["id"])
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+
+        # id 0 plays all categories
+        if category_id != 0 and category_id not in category_cache.get().categories:
+            abort(404)
+
+        # The deck is a random sample of at most QUIZ_DECK_MAX ids, drawn
+        # from the in-process id arrays without loading the category
+        session = quiz_sessions.create(
+            quiz_category,
+            question_counts.sample(category_id or None, (), quiz_sessions.max_deck),
+        )
+
+        return jsonify(
+            {
+                "success": True,
+                "session_id": session.id,
+                "quiz_category": quiz_category,
+                "total_questions": len(session.deck),
+            }
+        )
+
+    @app.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+    @cross_origin()
+    def next_quiz_question(session_id):
+        while True:
+            session, question_id = quiz_sessions.draw(session_id)
+            if session is None:
+                abort(404)
+            if question_id is None:
+                question = None
+                break
+            # Skip questions deleted since the session started
+            question = get_question(question_id)
+            if question is not None:
+                break
+
+        return jsonify(
+            {
+                "success": True,
+                "quiz_category": session.quiz_category,
+                "question": question,
+                "asked": session.asked,
+                "remaining": len(session.deck),
+            }
+        )
+
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    @cross_origin()
+    def end_quiz_session(session_id):
+        if not quiz_sessions.discard(session_id):
+            abort(404)
+
+        return jsonify({"success": True, "ended": session_id})
+
+    """
+    Batch: several GET and POST requests for the other routes in one round
+    trip, e.g. {"requests": [{"method": "GET", "path": "/questions"}, ...]}.
+    They are answered together, in order, each with its status and body.
+    """
+
+    @app.route("/batch", methods=["POST"])
+    @cross_origin()
+    def batch_requests():
+        body = request.get_json()
+
+        # A body that is not a list of supported sub-requests is rejected whole
+        try:
+            batch = parse_batch(body)
+        except ValueError:
+            abort(422)
+
+        # Sub-requests share this request's session unless run in parallel
+        responses = batch_dispatcher.run(batch, parallel=bool(body.get("parallel")))
+        return jsonify({"success": True, "responses": responses})
+
+    """
+    Connection pool statistics of this worker process.
+    """
+
+    def current_pool_stats():
+        pool = db.engine.pool
+        stats = pool.stats() if hasattr(pool, "stats") else {"pid": os.getpid()}
+        stats["pool"] = type(pool).__name__
+        return stats
+
+    @app.route("/stats/pool")
+    @cross_origin()
+    def pool_stats():
+        return jsonify({"success": True, "pool": current_pool_stats()})
+
+    """
+    Request latency, SQL and pool metrics of this worker process in the
+    Prometheus text format.
+    """
+
+    @app.route("/metrics")
+    @cross_origin()
+    def metrics():
+        return Response(
+            instrumentation.render(current_pool_stats()),
+            mimetype="text/plain; version=0.0.4",
+        )
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -364,6 +860,16 @@ def create_app(test_config=None):  # sourcery skip: do-not-use-bare-except
             405,
         )
 
+    @app.errorhandler(415)
+    @cross_origin()
+    def unsupported_media_type(error):
+        return (
+            jsonify(
+                {"success": False, "error": 415, "message": "unsupported media type"}
+            ),
+            415,
+        )
+
     @app.errorhandler(422)
     @cross_origin()
     def unprocessable(error):
@@ -0,0 +1,215 @@
+import bisect
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+# /stats/pool field: (metric type, metric name)
+POOL_METRICS = {
+    "size": ("gauge", "trivia_db_pool_size"),
+    "checked_out": ("gauge", "trivia_db_pool_checked_out"),
+    "checked_in": ("gauge", "trivia_db_pool_checked_in"),
+    "overflow": ("gauge", "trivia_db_pool_overflow"),
+    "checkouts": ("counter", "trivia_db_pool_checkouts_total"),
+    "timeouts": ("counter", "trivia_db_pool_timeouts_total"),
+    "wait_seconds_total": ("counter", "trivia_db_pool_wait_seconds_total"),
+    "wait_seconds_max": ("gauge", "trivia_db_pool_wait_seconds_max"),
+}
+
+
+"""
+RequestStats
+    SQL work of the current request, collected from the engine's cursor
+    events into flask.g.
+"""
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = g.get("request_stats") if has_request_context() else None
+    if stats is None:
+        return
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if len(stats.statements) < MAX_LOGGED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+"""
+Instrumentation
+    per-process request metrics: a latency histogram, request counts by
+    status, SQL statement counts and SQL time per endpoint. Requests slower
+    than SLOW_REQUEST_MS are logged with their statements. render() writes
+    everything in the Prometheus text format. Recording a request is a
+    few dictionary updates under one lock.
+"""
+
+
+class Instrumentation:
+    def __init__(self, slow_request_ms=500):
+        self.slow_request_ms = slow_request_ms
+        self._lock = threading.Lock()
+        # (endpoint, method) -> [bucket counts..., +Inf count, sum of seconds]
+        self._latency = {}
+        # (endpoint, method, status) -> count
+        self._requests = {}
+        # (endpoint, method) -> [statements, seconds]
+        self._sql = {}
+        self._slow_requests = 0
+
+    def init_app(self, app):
+        self.slow_request_ms = app.config.get("SLOW_REQUEST_MS", self.slow_request_ms)
+        app.extensions["instrumentation"] = self
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _start_request(self):
+        g.request_stats = RequestStats()
+
+    def _finish_request(self, response):
+        stats = g.get("request_stats")
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        self.record(endpoint, request.method, response.status_code, elapsed, stats)
+
+        if elapsed * 1000 >= self.slow_request_ms:
+            with self._lock:
+                self._slow_requests += 1
+            current_app.logger.warning(
+                "slow request %s %s: %.1f ms, %d statements, %.1f ms SQL\n%s",
+                request.method,
+                request.full_path,
+                elapsed * 1000,
+                stats.sql_count,
+                stats.sql_seconds * 1000,
+                "\n".join(
+                    "  {:.1f} ms  {}".format(
+                        seconds * 1000, " ".join(statement.split())
+                    )
+                    for seconds, statement in stats.statements
+                ),
+            )
+        return response
+
+    def record(self, endpoint, method, status, seconds, stats):
+        key = (endpoint, method)
+        with self._lock:
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            latency[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            latency[-1] += seconds
+
+            status_key = (endpoint, method, status)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+
+            sql = self._sql.get(key)
+            if sql is None:
+                sql = self._sql[key] = [0, 0.0]
+            sql[0] += stats.sql_count
+            sql[1] += stats.sql_seconds
+
+    def render(self, pool_stats=None):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            latency = {key: list(value) for key, value in self._latency.items()}
+            requests = dict(self._requests)
+            sql = {key: list(value) for key, value in self._sql.items()}
+            slow_requests = self._slow_requests
+
+        def labels(endpoint, method, **extra):
+            pairs = [("endpoint", endpoint), ("method", method)] + list(extra.items())
+            return ",".join('{}="{}"'.format(name, value) for name, value in pairs)
+
+        lines = [
+            "# HELP trivia_request_duration_seconds Request latency by endpoint.",
+            "# TYPE trivia_request_duration_seconds histogram",
+        ]
+        for (endpoint, method), counts in sorted(latency.items()):
+            cumulative = 0
+            bounds = [repr(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    "trivia_request_duration_seconds_bucket{{{}}} {}".format(
+                        labels(endpoint, method, le=bound), cumulative
+                    )
+                )
+            lines.append(
+                "trivia_request_duration_seconds_sum{{{}}} {}".format(
+                    labels(endpoint, method), counts[-1]
+                )
+            )
+            lines.append(
+                "trivia_request_duration_seconds_count{{{}}} {}".format(
+                    labels(endpoint, method), cumulative
+                )
+            )
+
+        lines += [
+            "# HELP trivia_requests_total Requests by endpoint and status.",
+            "# TYPE trivia_requests_total counter",
+        ]
+        for (endpoint, method, status), count in sorted(requests.items()):
+            lines.append(
+                "trivia_requests_total{{{}}} {}".format(
+                    labels(endpoint, method, status=status), count
+                )
+            )
+
+        lines += [
+            "# HELP trivia_sql_statements_total SQL statements run by endpoint.",
+            "# TYPE trivia_sql_statements_total counter",
+        ]
+        for (endpoint, method), (count, _) in sorted(sql.items()):
+            lines.append(
+                "trivia_sql_statements_total{{{}}} {}".format(
+                    labels(endpoint, method), count
+                )
+            )
+        lines += [
+            "# HELP trivia_sql_duration_seconds_total Time spent in SQL by endpoint.",
+            "# TYPE trivia_sql_duration_seconds_total counter",
+        ]
+        for (endpoint, method), (_, seconds) in sorted(sql.items()):
+            lines.append(
+                "trivia_sql_duration_seconds_total{{{}}} {}".format(
+                    labels(endpoint, method), seconds
+                )
+            )
+
+        lines += [
+            "# HELP trivia_slow_requests_total Requests slower than SLOW_REQUEST_MS.",
+            "# TYPE trivia_slow_requests_total counter",
+            "trivia_slow_requests_total {}".format(slow_requests),
+        ]
+
+        for field, (kind, name) in POOL_METRICS.items():
+            if pool_stats and field in pool_stats:
+                lines += [
+                    "# TYPE {} {}".format(name, kind),
+                    "{} {}".format(name, pool_stats[field]),
+                ]
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,82 @@
+import json
+import flask
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+
+"""
+JSON backends
+    create_app picks one with the JSON_BACKEND setting: "orjson", "stdlib"
+    or unset for orjson when it is installed. Both produce the same
+    documents as flask.jsonify: sorted keys, compact separators and a
+    trailing newline. Only string escaping differs, orjson writes UTF-8
+    where the stdlib escapes non-ASCII characters.
+"""
+
+
+class StdlibBackend:
+    name = "stdlib"
+
+    def response(self, payload):
+        return flask.jsonify(payload)
+
+    def encode(self, payload):
+        # what flask.jsonify writes outside debug mode
+        return (
+            json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n"
+        ).encode()
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        self._response_options = (
+            orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        )
+
+    def response(self, payload):
+        return current_app.response_class(
+            self.encode(payload),
+            mimetype=current_app.config.get("JSONIFY_MIMETYPE", "application/json"),
+        )
+
+    def encode(self, payload):
+        return orjson.dumps(payload, option=self._response_options)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj).decode()
+
+
+def init_json(app):
+    name = app.config.get("JSON_BACKEND", None)
+    if name is None:
+        name = "stdlib" if orjson is None else "orjson"
+
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("JSON_BACKEND is 'orjson' but orjson is not installed")
+        backend = OrjsonBackend()
+    elif name == "stdlib":
+        backend = StdlibBackend()
+    else:
+        raise ValueError("unknown JSON_BACKEND {!r}".format(name))
+
+    app.extensions["json_backend"] = backend
+    return backend
+
+
+def jsonify(payload):
+    """Drop-in for flask.jsonify(dict) using the app's JSON backend."""
+    return current_app.extensions["json_backend"].response(payload)
+
+
+def dumps(obj):
+    return current_app.extensions["json_backend"].dumps(obj)
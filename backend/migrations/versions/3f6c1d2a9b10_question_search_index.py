@@ -0,0 +1,38 @@
+"""trigram index for question search
+
+Revision ID: 3f6c1d2a9b10
+Revises: 
+Create Date: 2026-10-18 09:12:41.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c1d2a9b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /questions/search filters with ILIKE '%term%' and ranks with
+    # similarity(); both are served by a pg_trgm GIN index. Other
+    # databases use the in-process index in search.py instead.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_questions_question_trgm',
+        'questions',
+        ['question'],
+        postgresql_using='gin',
+        postgresql_ops={'question': 'gin_trgm_ops'},
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
@@ -0,0 +1,61 @@
+"""integer category foreign key and listing indexes
+
+Revision ID: 8a41e7c05d2f
+Revises: 3f6c1d2a9b10
+Create Date: 2026-10-18 14:03:27.915320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a41e7c05d2f'
+down_revision = '3f6c1d2a9b10'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_questions_difficulty_category_id': ['difficulty', 'category', 'id'],
+    'ix_questions_category_difficulty_id': ['category', 'difficulty', 'id'],
+}
+
+
+def upgrade():
+    # Databases restored from trivia.psql already have an integer category
+    # with a foreign key; ones created from the old model have text.
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name']: column for column in inspector.get_columns('questions')}
+    has_foreign_key = any(
+        foreign_key['referred_table'] == 'categories'
+        for foreign_key in inspector.get_foreign_keys('questions')
+    )
+    existing_indexes = {index['name'] for index in inspector.get_indexes('questions')}
+
+    with op.batch_alter_table('questions') as batch_op:
+        if not isinstance(columns['category']['type'], sa.Integer):
+            batch_op.alter_column(
+                'category',
+                existing_type=columns['category']['type'],
+                type_=sa.Integer(),
+                postgresql_using='category::integer',
+            )
+        if not has_foreign_key:
+            batch_op.create_foreign_key(
+                'category',
+                'categories',
+                ['category'],
+                ['id'],
+                onupdate='CASCADE',
+                ondelete='SET NULL',
+            )
+
+    for name, columns in INDEXES.items():
+        if name not in existing_indexes:
+            op.create_index(name, 'questions', columns)
+
+
+def downgrade():
+    # The integer type and the foreign key are kept, they match trivia.psql
+    for name in INDEXES:
+        op.drop_index(name, table_name='questions')
@@ -0,0 +1,66 @@
+"""listing indexes on NULL-safe sort keys
+
+Revision ID: c52e9b7f3a18
+Revises: 8a41e7c05d2f
+Create Date: 2026-10-19 10:21:06.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e9b7f3a18'
+down_revision = '8a41e7c05d2f'
+branch_labels = None
+depends_on = None
+
+OLD_INDEXES = {
+    'ix_questions_difficulty_category_id': ['difficulty', 'category', 'id'],
+    'ix_questions_category_difficulty_id': ['category', 'difficulty', 'id'],
+}
+# The listings order by coalesce(difficulty, -1), coalesce(category, -1), id
+# so NULLs never break the keyset predicate, see models.sort_key
+NEW_INDEXES = {
+    'ix_questions_listing': [
+        'coalesce(difficulty, -1)', 'coalesce(category, -1)', 'id'
+    ],
+    'ix_questions_category_listing': [
+        'category', 'coalesce(difficulty, -1)', 'coalesce(category, -1)', 'id'
+    ],
+}
+
+
+def index_names(bind):
+    # The inspector skips expression indexes, ask the catalog instead
+    if bind.dialect.name == 'sqlite':
+        query = (
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = 'questions'"
+        )
+    elif bind.dialect.name == 'postgresql':
+        query = (
+            "SELECT indexname FROM pg_indexes "
+            "WHERE tablename = 'questions' AND schemaname = current_schema()"
+        )
+    else:
+        return {index['name'] for index in sa.inspect(bind).get_indexes('questions')}
+    return {name for (name,) in bind.execute(sa.text(query))}
+
+
+def upgrade():
+    existing_indexes = index_names(op.get_bind())
+    # Databases set up by db.create_all() already have the new indexes
+    for name, expressions in NEW_INDEXES.items():
+        if name not in existing_indexes:
+            op.create_index(name, 'questions', [sa.text(e) for e in expressions])
+    for name in OLD_INDEXES:
+        if name in existing_indexes:
+            op.drop_index(name, table_name='questions')
+
+
+def downgrade():
+    for name, columns in OLD_INDEXES.items():
+        op.create_index(name, 'questions', columns)
+    for name in NEW_INDEXES:
+        op.drop_index(name, table_name='questions')
@@ -0,0 +1,30 @@
+"""(category, id) index for the question id arrays
+
+Revision ID: d7e3a9c1f524
+Revises: c52e9b7f3a18
+Create Date: 2026-10-20 09:41:52.106733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3a9c1f524'
+down_revision = 'c52e9b7f3a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # question_counts reads the ids of every category in (category, id)
+    # order; db.create_all() may have created the index already
+    existing_indexes = {
+        index['name'] for index in sa.inspect(op.get_bind()).get_indexes('questions')
+    }
+    if 'ix_questions_category_id' not in existing_indexes:
+        op.create_index('ix_questions_category_id', 'questions', ['category', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_questions_category_id', table_name='questions')
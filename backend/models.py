@@ -1,28 +1,67 @@
 # sourcery skip: simplify-fstring-formatting, use-fstring-for-formatting
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import random
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from sqlalchemy import Column, ForeignKey, Index, String, Integer, create_engine, func
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
 import json
 
+from engine import engine_options, load_db_settings
+from replicas import replicas
+
 database_name = "trivia"
 database_path = "postgresql://{}:{}@{}/{}".format(
     "postgres", "Possible001#", "localhost:5432", database_name
 )
 
-db = SQLAlchemy()
+
+"""
+RoutingSession
+    sends the reads of read-only views to the request's replica (see
+    replicas.py); flushes and everything else go to the primary.
+"""
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = None if self._flushing else replicas.read_engine()
+        return replica or super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, with the engine
+    and pool configured from the DB_* settings (see engine.py);
+    DB_ENGINE_OPTIONS can override any create_engine() option
 """
 
 
 def setup_db(app, database_path=database_path):
+    load_db_settings(app.config)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    options = engine_options(database_path, app.config)
+    options.update(app.config.get("DB_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
     db.create_all()
+    question_counts.reset()
+    category_cache.invalidate()
+    data_version.bump()
 
 
 """
@@ -37,7 +76,10 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(
+        Integer,
+        ForeignKey("categories.id", onupdate="CASCADE", ondelete="SET NULL"),
+    )
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -48,14 +90,23 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        # flushed first so the id is read before the commit expires it
+        db.session.flush()
+        category, question_id = self.category, self.id
         db.session.commit()
+        question_counts.added(category, question_id)
+        data_version.bump()
 
     def update(self):
         db.session.commit()
+        data_version.bump()
 
     def delete(self):
+        category, question_id = self.category, self.id
         db.session.delete(self)
         db.session.commit()
+        question_counts.removed(category, question_id)
+        data_version.bump()
 
     def format(self):
         return {
@@ -67,6 +118,234 @@ class Question(db.Model):
         }
 
 
+# difficulty and category may be NULL (questions posted without them,
+# categories deleted). The listings sort on sort_key() of them, which puts
+# NULL first as NULL_SORT_KEY, so a keyset predicate never compares with
+# NULL and skips no rows.
+NULL_SORT_KEY = -1
+
+
+def sort_key(column):
+    return func.coalesce(column, NULL_SORT_KEY)
+
+
+# The listings order by the sort keys of (difficulty, category, id); the
+# category pages filter on category first
+Index(
+    "ix_questions_listing",
+    sort_key(Question.difficulty),
+    sort_key(Question.category),
+    Question.id,
+)
+Index(
+    "ix_questions_category_listing",
+    Question.category,
+    sort_key(Question.difficulty),
+    sort_key(Question.category),
+    Question.id,
+)
+# question_counts loads the ids of every category in this order
+Index("ix_questions_category_id", Question.category, Question.id)
+
+"""
+DataVersion
+    monotonically increasing version of the trivia data, bumped by every
+    Question and Category write. The ETag combines it with a token unique
+    to this process, so tags from different workers never match.
+
+    Both validators (ETag and Last-Modified) only track the writes of this
+    process: a write handled by another worker changes neither, and this
+    worker keeps answering 304 for its own validators until it writes or
+    restarts. Deployments with several writing workers should route
+    conditional requests to one worker or not rely on them.
+"""
+
+
+class DataVersion:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.last_modified = time.time()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self.last_modified = time.time()
+
+    def etag(self):
+        return "{}-{}".format(self._epoch, self.version)
+
+    def changed_after(self):
+        """The first whole second after the last write. HTTP dates have one
+        second resolution, so only an If-Modified-Since at or past this
+        second has seen every write."""
+        return int(self.last_modified) + 1
+
+    def http_last_modified(self):
+        """The Last-Modified to send: changed_after(), but never a second
+        that has not started yet. An earlier date only costs a 200 on the
+        next If-Modified-Since, never a stale 304."""
+        return min(self.changed_after(), int(time.time()))
+
+
+data_version = DataVersion()
+
+
+"""
+QuestionCounts
+    question totals per category, loaded with a single
+    COUNT(*) ... GROUP BY query and kept current by Question.insert(),
+    Question.delete() and the write batcher, so reading a total never
+    touches the database.
+
+    sample() draws from the question ids of every category, kept as sorted
+    arrays of 32 bit ints (4 bytes a question). They are loaded on the
+    first draw with one query over the (category, id) index and kept
+    current by the same writes, so a draw is uniform and needs no query
+    whatever the size of the bank. Writes made outside this process are
+    not seen until reset().
+"""
+
+
+class QuestionCounts:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_category = None
+        self._total = 0
+        self._ids = None
+
+    @staticmethod
+    def _key(category):
+        return None if category is None else str(category)
+
+    def _load(self):
+        # the totals are kept current by this process' writes, so they are
+        # counted on the primary
+        with replicas.primary():
+            rows = (
+                db.session.query(Question.category, func.count(Question.id))
+                .group_by(Question.category)
+                .all()
+            )
+        self._by_category = {}
+        for category, count in rows:
+            key = self._key(category)
+            self._by_category[key] = self._by_category.get(key, 0) + count
+        self._total = sum(self._by_category.values())
+
+    def _load_ids(self):
+        with replicas.primary():
+            rows = (
+                db.session.query(Question.category, Question.id)
+                .order_by(Question.category, Question.id)
+                .yield_per(10000)
+            )
+            self._ids = {}
+            for category, question_id in rows:
+                key = self._key(category)
+                ids = self._ids.get(key)
+                if ids is None:
+                    ids = self._ids[key] = array("i")
+                ids.append(question_id)
+
+    @property
+    def loaded(self):
+        return self._by_category is not None
+
+    def load(self):
+        """Load the totals and the id arrays ahead of the first request."""
+        with self._lock:
+            if self._by_category is None:
+                self._load()
+            if self._ids is None:
+                self._load_ids()
+
+    def reset(self):
+        with self._lock:
+            self._by_category = None
+            self._ids = None
+
+    def total(self, category=None):
+        with self._lock:
+            if self._by_category is None:
+                self._load()
+            if category is None:
+                return self._total
+            return self._by_category.get(self._key(category), 0)
+
+    def sample(self, category, exclude, count):
+        """Up to ``count`` distinct random question ids of ``category``
+        (None: all) that are not in ``exclude``, every one equally likely.
+
+        Random positions are drawn until enough ids outside ``exclude``
+        were found; when most of the category is excluded the ids left are
+        listed and sampled instead.
+        """
+        exclude = set(exclude)
+        with self._lock:
+            if self._ids is None:
+                self._load_ids()
+            if category is None:
+                arrays = list(self._ids.values())
+            else:
+                arrays = [self._ids.get(self._key(category), ())]
+            size = sum(len(ids) for ids in arrays)
+
+            def at(position):
+                for ids in arrays:
+                    if position < len(ids):
+                        return ids[position]
+                    position -= len(ids)
+
+            picked = []
+            for _ in range(8 * count):
+                if len(picked) == count or not size:
+                    break
+                question_id = at(random.randrange(size))
+                if question_id not in exclude and question_id not in picked:
+                    picked.append(question_id)
+
+            if len(picked) < count:
+                # most of the category was played, draw from what is left
+                remaining = [
+                    question_id
+                    for ids in arrays
+                    for question_id in ids
+                    if question_id not in exclude and question_id not in picked
+                ]
+                picked += random.sample(
+                    remaining, min(count - len(picked), len(remaining))
+                )
+            return picked
+
+    def _adjust(self, category, question_id, delta):
+        with self._lock:
+            # what is not loaded yet is loaded from scratch on the next read
+            key = self._key(category)
+            if self._by_category is not None:
+                self._by_category[key] = self._by_category.get(key, 0) + delta
+                self._total += delta
+            if self._ids is None:
+                return
+            ids = self._ids.setdefault(key, array("i"))
+            position = bisect_left(ids, question_id)
+            present = position < len(ids) and ids[position] == question_id
+            if delta > 0 and not present:
+                ids.insert(position, question_id)
+            elif delta < 0 and present:
+                del ids[position]
+
+    def added(self, category, question_id):
+        self._adjust(category, question_id, 1)
+
+    def removed(self, category, question_id):
+        self._adjust(category, question_id, -1)
+
+
+question_counts = QuestionCounts()
+
+
 """
 Category
 
@@ -82,5 +361,63 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_cache.invalidate()
+        data_version.bump()
+
+    def update(self):
+        db.session.commit()
+        category_cache.invalidate()
+        data_version.bump()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        category_cache.invalidate()
+        data_version.bump()
+
     def format(self):
         return {"id": self.id, "type": self.type}
+
+
+"""
+CategoryCache
+    process-wide snapshot of the {id: type} category map. The snapshot is
+    loaded on first use and replaced, with a new version number, after
+    every Category write. Snapshots are shared between requests and must
+    not be modified.
+"""
+
+CategorySnapshot = namedtuple("CategorySnapshot", ["version", "categories"])
+
+
+class CategoryCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot = None
+
+    def get(self):
+        with self._lock:
+            if self._snapshot is None:
+                with replicas.primary():
+                    categories = {
+                        category.id: category.type
+                        for category in Category.query.order_by(Category.id).all()
+                    }
+                self._snapshot = CategorySnapshot(self._version, categories)
+            return self._snapshot
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+
+category_cache = CategoryCache()
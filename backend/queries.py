@@ -0,0 +1,27 @@
+from models import Question
+
+"""
+Read layer
+    the read-only endpoints select the question columns they return as
+    plain row tuples instead of loading Question instances: no ORM objects
+    are built and nothing is added to the session identity map. Rows are
+    turned into the same dicts Question.format() returns.
+"""
+
+QUESTION_FIELDS = ("id", "question", "answer", "category", "difficulty")
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+
+def question_rows(selection, *extra_columns):
+    """Project a Question query onto the formatted columns, followed by
+    ``extra_columns``."""
+    return selection.with_entities(*(QUESTION_COLUMNS + extra_columns))
+
+
+def format_question(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+def get_question(question_id):
+    row = question_rows(Question.query).filter(Question.id == question_id).first()
+    return None if row is None else format_question(row)
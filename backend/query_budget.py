@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+QueryRecorder
+    records every SQL statement run on any engine while it is active,
+    together with the number of rows fetched from its cursor. Rows are
+    counted by wrapping the DBAPI cursor before SQLAlchemy builds the
+    result from it, so ORM queries, column projections and Core statements
+    are all covered.
+"""
+
+
+class QueryRecorder:
+    def __init__(self):
+        # [statement, rows fetched]
+        self.statements = []
+
+    @property
+    def queries(self):
+        return len(self.statements)
+
+    @property
+    def rows(self):
+        return sum(rows for _, rows in self.statements)
+
+    def __enter__(self):
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        record = [" ".join(statement.split()), 0]
+        self.statements.append(record)
+        if context is not None and cursor.description is not None:
+            context.cursor = _CountingCursor(cursor, record)
+
+    def report(self):
+        return "\n".join(
+            "  {:>6} rows  {}".format(rows, statement)
+            for statement, rows in self.statements
+        )
+
+
+class _CountingCursor:
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._record[1] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._record[1] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._record[1] += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._record[1] += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+"""
+query_budget(max_queries, max_rows)
+    fails with an AssertionError listing the statements if the block runs
+    more than max_queries statements or fetches more than max_rows rows:
+
+        with query_budget(max_queries=3, max_rows=20):
+            res = self.client().get("/questions")
+
+    A budget sized for one page of results catches reads that grow with
+    the table.
+"""
+
+
+@contextmanager
+def query_budget(max_queries=None, max_rows=None):
+    with QueryRecorder() as recorder:
+        yield recorder
+
+    if max_queries is not None and recorder.queries > max_queries:
+        raise AssertionError(
+            "{} queries, budget is {}:\n{}".format(
+                recorder.queries, max_queries, recorder.report()
+            )
+        )
+    if max_rows is not None and recorder.rows > max_rows:
+        raise AssertionError(
+            "{} rows fetched, budget is {}:\n{}".format(
+                recorder.rows, max_rows, recorder.report()
+            )
+        )
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question
+
+# rows per multi-row INSERT statement
+IMPORT_BATCH_SIZE = 500
+# rows per transaction
+IMPORT_COMMIT_SIZE = 5000
+# per-row errors kept for the response, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# rows fetched per round trip from the server-side cursor, and per chunk
+# of the streamed response
+EXPORT_BATCH_SIZE = 1000
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonlines", "application/json")
+CSV_TYPES = ("text/csv",)
+
+
+"""
+read_rows(lines, content_type)
+    parses an iterable of raw body lines as NDJSON or CSV (with a header
+    row) and yields (row_number, row) pairs one at a time, where row is a
+    dict or the ValueError raised while parsing that row. A line that is
+    not UTF-8 or a malformed CSV record only fails its own row.
+"""
+
+
+def read_rows(lines, content_type):
+    if content_type in CSV_TYPES:
+        yield from read_csv_rows(lines)
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError as error:
+            yield row_number, ValueError("invalid UTF-8: {}".format(error))
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield row_number, ValueError("invalid JSON: {}".format(error))
+            continue
+        if not isinstance(row, dict):
+            row = ValueError("expected a JSON object")
+        yield row_number, row
+
+
+def read_csv_rows(lines):
+    # what csv.DictReader does, except that decoding and csv errors are
+    # reported for the record they occur in instead of ending the import
+    decode_errors = []
+
+    def text_lines():
+        for line in lines:
+            try:
+                yield line.decode("utf-8")
+            except UnicodeDecodeError as error:
+                decode_errors.append(error)
+                # ends the current record, which is then reported
+                yield "\n"
+
+    reader = csv.reader(text_lines())
+    try:
+        fieldnames = next(reader, None)
+    except csv.Error as error:
+        fieldnames, decode_errors[:] = None, [error]
+    if decode_errors:
+        yield 0, ValueError("invalid CSV header: {}".format(decode_errors[0]))
+        return
+    if not fieldnames:
+        return
+
+    row_number = 0
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            row_number += 1
+            del decode_errors[:]
+            yield row_number, ValueError("invalid CSV: {}".format(error))
+            continue
+        if decode_errors:
+            row_number += 1
+            error = decode_errors[0]
+            del decode_errors[:]
+            yield row_number, ValueError("invalid UTF-8: {}".format(error))
+            continue
+        if not values:
+            continue
+        row_number += 1
+        row = dict.fromkeys(fieldnames)
+        row.update(zip(fieldnames, values))
+        yield row_number, row
+
+
+def validate_question(row, categories):
+    """Return the column values of one imported question or raise ValueError."""
+    values = {}
+    for field in ("question", "answer"):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError("{} is required".format(field))
+        values[field] = value
+
+    try:
+        category = int(row.get("category"))
+    except (TypeError, ValueError):
+        raise ValueError("category must be a category id")
+    if category not in categories:
+        raise ValueError("unknown category {}".format(category))
+    values["category"] = category
+
+    difficulty = row.get("difficulty")
+    if difficulty in (None, ""):
+        values["difficulty"] = None
+    else:
+        try:
+            values["difficulty"] = int(difficulty)
+        except (TypeError, ValueError):
+            raise ValueError("difficulty must be an integer")
+
+    return values
+
+
+"""
+import_questions(rows, categories, batch_size, commit_size)
+    validates the (row_number, row) pairs from read_rows() as they arrive
+    and inserts the valid ones with multi-row INSERT statements of
+    ``batch_size`` rows, committing every ``commit_size`` rows. Only the
+    current batch is held in memory. A database error rolls back the
+    uncommitted rows, reports them as failed and the import carries on.
+    Returns a summary dict for the response.
+"""
+
+
+def import_questions(
+    rows, categories, batch_size=IMPORT_BATCH_SIZE, commit_size=IMPORT_COMMIT_SIZE
+):
+    summary = {"imported": 0, "failed": 0, "errors": []}
+    batch = []
+    uncommitted = 0
+
+    def report(error):
+        summary["failed"] += error.get("rows", 1)
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append(error)
+
+    def write(commit):
+        nonlocal uncommitted
+        try:
+            if batch:
+                db.session.execute(Question.__table__.insert().values(batch))
+            if commit:
+                db.session.commit()
+                summary["imported"] += uncommitted
+                uncommitted = 0
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            report({"rows": uncommitted, "error": str(getattr(error, "orig", error))})
+            uncommitted = 0
+        del batch[:]
+
+    for row_number, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise row
+            batch.append(validate_question(row, categories))
+        except ValueError as error:
+            report({"row": row_number, "error": str(error)})
+            continue
+
+        uncommitted += 1
+        if len(batch) >= batch_size:
+            write(commit=uncommitted >= commit_size)
+
+    write(commit=True)
+    return summary
+
+
+"""
+export_rows(rows, fields, fmt, dumps)
+    turns an iterable of row tuples into text chunks of NDJSON objects
+    (encoded with ``dumps``) or CSV lines after a header row,
+    EXPORT_BATCH_SIZE rows per chunk, so a response generator can stream
+    them without building the whole body.
+"""
+
+
+def export_rows(rows, fields, fmt, dumps=json.dumps):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(fields)
+
+    for count, row in enumerate(rows, start=1):
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            buffer.write(dumps(dict(zip(fields, row))))
+            buffer.write("\n")
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,104 @@
+import random
+from array import array
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+"""
+QuizSession
+    one quiz being played: the category it was started for and the ids of
+    the questions still to be asked, shuffled once when the session starts
+    and kept as a compact array of 32 bit ints.
+"""
+
+
+class QuizSession:
+    def __init__(self, quiz_category, deck, expires_at):
+        self.id = secrets.token_urlsafe(16)
+        self.quiz_category = quiz_category
+        self.deck = deck
+        self.asked = 0
+        self.expires_at = expires_at
+
+
+"""
+QuizSessionStore
+    bounded in-process store of quiz sessions. A session expires ``ttl``
+    seconds after it was last used, and once ``max_sessions`` are live the
+    least recently used one is evicted. A deck holds at most ``max_deck``
+    question ids, a random sample when the category has more, so a worker
+    keeps at most about max_sessions * (4 * max_deck + 500) bytes of
+    sessions (13 MB with the defaults). Sessions live in the worker that
+    created them, so multi-worker deployments need sticky routing.
+"""
+
+
+class QuizSessionStore:
+    def __init__(
+        self, max_sessions=10000, ttl=3600, max_deck=200, clock=time.monotonic
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_deck = max_deck
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            self._evict_expired(self._clock())
+            return len(self._sessions)
+
+    def _evict_expired(self, now):
+        # sessions are kept in order of last use, so expired ones are first
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.expires_at > now:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, quiz_category, question_ids):
+        deck = list(question_ids)
+        if len(deck) > self.max_deck:
+            deck = random.sample(deck, self.max_deck)
+        else:
+            random.shuffle(deck)
+        deck = array("i", deck)
+        with self._lock:
+            now = self._clock()
+            self._evict_expired(now)
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            session = QuizSession(quiz_category, deck, now + self.ttl)
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            now = self._clock()
+            self._evict_expired(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.expires_at = now + self.ttl
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def draw(self, session_id):
+        """Take the next question id off the session's deck.
+
+        Returns (session, question_id); the id is None once the deck is
+        exhausted and the session is None when it is unknown or expired.
+        """
+        session = self.get(session_id)
+        if session is None:
+            return None, None
+        with self._lock:
+            if not session.deck:
+                return session, None
+            session.asked += 1
+            return session, session.deck.pop()
+
+    def discard(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
@@ -0,0 +1,113 @@
+import itertools
+import math
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+from engine import engine_options
+
+# set on responses to requests that wrote; while it lasts, that client's
+# reads go to the primary in every worker
+WRITE_COOKIE = "trivia_wrote"
+
+
+"""
+ReplicaRouter
+    sends the reads of the views marked read_only to one of the
+    DB_REPLICA_URLS engines, picked round-robin once per request so all
+    statements of a request see the same replica. Everything else, ORM
+    flushes and reads outside those views, goes to the primary.
+
+    Replicas are assumed to trail the primary by at most
+    DB_REPLICA_LAG_SECONDS. For that long after a commit on the primary,
+    the process reads from the primary only, so its in-process caches never
+    load data older than its own writes, and the client that wrote carries
+    WRITE_COOKIE, which sends its reads to the primary in every worker.
+"""
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.engines = []
+        self.lag_seconds = 5.0
+        self._last_write = 0.0
+        self._turn = itertools.count()
+
+    def init_app(self, app):
+        for engine in self.engines:
+            engine.dispose()
+        urls = app.config["DB_REPLICA_URLS"]
+        if isinstance(urls, str):
+            urls = urls.replace(",", " ").split()
+        self.engines = [
+            create_engine(url, **engine_options(url, app.config)) for url in urls
+        ]
+        self.lag_seconds = app.config["DB_REPLICA_LAG_SECONDS"]
+        self._last_write = 0.0
+        app.after_request(self._remember_write)
+
+    def choose(self):
+        """The replica for the reads of this request, None for the primary."""
+        if not self.engines or WRITE_COOKIE in request.cookies:
+            return None
+        if time.time() - self._last_write < self.lag_seconds:
+            return None
+        return self.engines[next(self._turn) % len(self.engines)]
+
+    def read_only(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.replica_engine = self.choose()
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    def read_engine(self):
+        return g.get("replica_engine") if has_request_context() else None
+
+    @contextmanager
+    def primary(self):
+        """Read from the primary inside the block, e.g. to fill a cache that
+        write methods keep current."""
+        engine = self.read_engine()
+        if engine is None:
+            yield
+            return
+        g.replica_engine = None
+        try:
+            yield
+        finally:
+            g.replica_engine = engine
+
+    def wrote(self, connection):
+        if connection.engine in self.engines:
+            return
+        self.note_write()
+
+    def note_write(self):
+        """Record a commit on the primary, also one made for this request on
+        another thread."""
+        self._last_write = time.time()
+        if has_request_context():
+            g.wrote_primary = True
+
+    def _remember_write(self, response):
+        if g.get("wrote_primary"):
+            response.set_cookie(
+                WRITE_COOKIE,
+                "1",
+                max_age=math.ceil(self.lag_seconds),
+                httponly=True,
+            )
+        return response
+
+
+replicas = ReplicaRouter()
+
+
+@event.listens_for(Engine, "commit")
+def _after_commit(connection):
+    replicas.wrote(connection)
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, request
+
+from models import data_version
+
+"""
+ResponseCache
+    LRU cache of rendered response bodies, bounded by entry count and total
+    bytes. Entries belong to one data_version and the whole cache is dropped
+    as soon as the version moves on, so question writes invalidate it.
+    data_version only follows the writes of this process: a write handled
+    by another worker is seen once the entries are ``max_age`` seconds old,
+    so a cached body is at most max_age seconds stale. max_age=None keeps
+    entries until the next local write, which is only safe with one worker.
+    Concurrent misses for the same key are coalesced: the first caller
+    computes the value while the others wait for it (single-flight).
+"""
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries=1024,
+        max_bytes=16 * 1024 * 1024,
+        max_age=5.0,
+        clock=time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        self._version = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def _lookup(self, key, version):
+        self._sync_version(version)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.max_age is not None and self._clock() - entry[2] >= self.max_age:
+            del self._entries[key]
+            self._bytes -= entry[1]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, version, value, size):
+        self._sync_version(version)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (value, size, self._clock())
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, computing it at most once.
+
+        ``compute`` returns (value, size, cacheable); uncacheable values are
+        handed to the caller that computed them and not stored.
+        """
+        if self.max_entries <= 0:
+            return compute()[0]
+
+        version = data_version.version
+        with self._lock:
+            entry = self._lookup(key, version)
+            if entry is not None:
+                return entry[0]
+            event = self._in_flight.get(key)
+            leader = event is None
+            if leader:
+                event = self._in_flight[key] = threading.Event()
+
+        if not leader:
+            event.wait()
+            with self._lock:
+                entry = self._lookup(key, data_version.version)
+            if entry is not None:
+                return entry[0]
+            # the leader failed or its result was not cacheable
+            return compute()[0]
+
+        try:
+            value, size, cacheable = compute()
+            if cacheable:
+                with self._lock:
+                    if data_version.version == version:
+                        self._store(key, version, value, size)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def cached(self, view):
+        """Serve successful responses of ``view`` from the cache.
+
+        The key is the method, path, query string and request body.
+        """
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (
+                request.method,
+                request.path,
+                tuple(sorted(request.args.items(multi=True))),
+                request.get_data(),
+            )
+
+            def compute():
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != 200:
+                    return response, 0, False
+                body = response.get_data()
+                return (body, response.mimetype), len(body), True
+
+            value = self.get_or_compute(key, compute)
+            if isinstance(value, tuple):
+                body, mimetype = value
+                return Response(body, mimetype=mimetype)
+            return value
+
+        return wrapper
@@ -0,0 +1,270 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Question
+from replicas import replicas
+
+# Above this many candidates an IN (...) list stops paying off and the
+# fallback filters with LIKE instead.
+MAX_INDEX_CANDIDATES = 500
+# Prefix index keys are cut to this many characters; longer prefixes are
+# checked against the question text.
+PREFIX_KEY_LENGTH = 32
+WORD_START = re.compile(r"\b\w")
+
+
+"""
+TrigramIndex
+    in-process inverted index from lower-cased character trigrams to
+    question ids, used where the database has no trigram index (SQLite,
+    test runs). It is built on the first search and kept current by the
+    session events below.
+"""
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._texts = None
+        self._postings = None
+
+    @staticmethod
+    def _trigrams(text):
+        return {text[i : i + 3] for i in range(len(text) - 2)}
+
+    def _add(self, question_id, text):
+        text = (text or "").lower()
+        self._texts[question_id] = text
+        for trigram in self._trigrams(text):
+            self._postings.setdefault(trigram, set()).add(question_id)
+
+    def _remove(self, question_id):
+        text = self._texts.pop(question_id, None)
+        if text is None:
+            return
+        for trigram in self._trigrams(text):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(question_id)
+                if not postings:
+                    del self._postings[trigram]
+
+    def _load(self):
+        self._texts = {}
+        self._postings = {}
+        # kept current by the session events below, so built from the primary
+        with replicas.primary():
+            rows = db.session.query(Question.id, Question.question).all()
+        for question_id, text in rows:
+            self._add(question_id, text)
+
+    def reset(self):
+        with self._lock:
+            self._texts = None
+            self._postings = None
+
+    def add(self, question_id, text):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(question_id)
+                self._add(question_id, text)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(question_id)
+
+    def candidates(self, term):
+        """Return the ids of questions containing ``term``, or None when the
+        term is too short for trigrams to narrow the search."""
+        term = term.lower()
+        trigrams = self._trigrams(term)
+        if not trigrams:
+            return None
+        with self._lock:
+            if self._texts is None:
+                self._load()
+            postings = sorted(
+                (self._postings.get(trigram, set()) for trigram in trigrams), key=len
+            )
+            ids = set(postings[0]).intersection(*postings[1:])
+            return {
+                question_id for question_id in ids if term in self._texts[question_id]
+            }
+
+
+question_index = TrigramIndex()
+
+
+"""
+PrefixIndex
+    sorted list of (key, question id) pairs for autocomplete, with one key
+    for every word of a question: the lower-cased text from the start of
+    that word, cut to PREFIX_KEY_LENGTH characters. All questions with a
+    word starting with a prefix sit next to each other in the list, found
+    with one binary search. Built by load() when the app starts and kept
+    current by the session events below.
+"""
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._texts = None
+
+    @staticmethod
+    def _prefix_keys(text):
+        text = (text or "").lower()
+        return {
+            text[match.start() : match.start() + PREFIX_KEY_LENGTH]
+            for match in WORD_START.finditer(text)
+        }
+
+    def _add(self, question_id, text):
+        self._texts[question_id] = text
+        for key in self._prefix_keys(text):
+            insort(self._keys, (key, question_id))
+
+    def _remove(self, question_id):
+        if question_id not in self._texts:
+            return
+        for key in self._prefix_keys(self._texts.pop(question_id)):
+            index = bisect_left(self._keys, (key, question_id))
+            if index < len(self._keys) and self._keys[index] == (key, question_id):
+                del self._keys[index]
+
+    def _load(self):
+        # kept current by the session events below, so built from the primary
+        with replicas.primary():
+            rows = db.session.query(Question.id, Question.question).all()
+        self._texts = dict(rows)
+        self._keys = sorted(
+            (key, question_id)
+            for question_id, text in rows
+            for key in self._prefix_keys(text)
+        )
+
+    def load(self):
+        with self._lock:
+            self._load()
+
+    def reset(self):
+        with self._lock:
+            self._keys = None
+            self._texts = None
+
+    def add(self, question_id, text):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(question_id)
+                self._add(question_id, text)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._texts is not None:
+                self._remove(question_id)
+
+    def suggest(self, prefix, limit):
+        """Return up to ``limit`` questions with a word starting with
+        ``prefix``, one per distinct text, as id and question dicts."""
+        prefix = prefix.lower()
+        key = prefix[:PREFIX_KEY_LENGTH]
+        suggestions = {}
+        with self._lock:
+            if self._texts is None:
+                self._load()
+            index = bisect_left(self._keys, (key,))
+            while index < len(self._keys) and len(suggestions) < limit:
+                candidate, question_id = self._keys[index]
+                if not candidate.startswith(key):
+                    break
+                index += 1
+                text = self._texts[question_id]
+                if text in suggestions or (
+                    len(prefix) > PREFIX_KEY_LENGTH and prefix not in text.lower()
+                ):
+                    continue
+                suggestions[text] = question_id
+        return [
+            {"id": question_id, "question": text}
+            for text, question_id in suggestions.items()
+        ]
+
+
+question_prefixes = PrefixIndex()
+
+
+# Flushed question changes are collected per session and only reach the
+# indexes once the transaction commits; a rollback drops them, so the
+# indexes never hold questions that were not committed.
+PENDING_CHANGES = "question_index_changes"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_question_changes(session, flush_context):
+    changes = session.info.setdefault(PENDING_CHANGES, [])
+    for target in list(session.new) + list(session.dirty):
+        if isinstance(target, Question):
+            changes.append(("add", target.id, target.question))
+    for target in session.deleted:
+        if isinstance(target, Question):
+            changes.append(("remove", target.id, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _index_question_changes(session):
+    for change, question_id, text in session.info.pop(PENDING_CHANGES, ()):
+        if change == "remove":
+            question_index.remove(question_id)
+            question_prefixes.remove(question_id)
+        else:
+            question_index.add(question_id, text)
+            question_prefixes.add(question_id, text)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_question_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%{}%".format(escaped)
+
+
+"""
+search_questions(term)
+    returns (selection, order_by, total) for the questions whose text
+    contains ``term``, one question per distinct text. On PostgreSQL the
+    match is an ILIKE served by the pg_trgm GIN index and results are
+    ranked by trigram similarity; elsewhere the in-process TrigramIndex
+    narrows the rows and shorter questions rank first. Ranking and
+    pagination both happen in the database.
+"""
+
+
+def search_questions(term):
+    term = str(term)
+    match = Question.question.ilike(_like_pattern(term), escape="\\")
+
+    if db.engine.dialect.name == "postgresql":
+        rank = -func.similarity(Question.question, term)
+    else:
+        rank = func.length(Question.question)
+        ids = question_index.candidates(term)
+        if ids is not None and len(ids) <= MAX_INDEX_CANDIDATES:
+            match = Question.id.in_(ids) if ids else Question.id.is_(None)
+
+    # keep the first question of every distinct text, like DISTINCT ON did
+    first_ids = (
+        db.session.query(func.min(Question.id))
+        .filter(match)
+        .group_by(Question.question)
+    )
+    selection = Question.query.filter(Question.id.in_(first_ids))
+
+    return selection, (rank, Question.id), first_ids.count()
@@ -0,0 +1,434 @@
+import logging
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where snapshot mode is unavailable
+    fcntl = None
+
+from models import (
+    db,
+    Question,
+    Category,
+    NULL_SORT_KEY,
+    category_cache,
+    data_version,
+    question_counts,
+)
+from queries import QUESTION_FIELDS, question_rows
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TRIVIA01"
+# magic, build time, questions, categories, questions in categories,
+# bytes of question text, bytes of answer text, bytes of category names
+HEADER = struct.Struct("=8sdIIIIII")
+# the arrays start on an 8-byte boundary
+HEADER_SIZE = (HEADER.size + 7) // 8 * 8
+# stands in for NULL in the integer columns, like it does in the sort keys
+# of the database listings
+NULL = NULL_SORT_KEY
+
+
+"""
+Snapshot file
+    the question bank as flat arrays in one file, in native byte order
+    (it is shared by the workers of one machine). After the header come,
+    each an int32 array:
+
+        id, category, difficulty          one entry per question, in
+                                          listing order (difficulty,
+                                          category, id)
+        question_offsets, answer_offsets  n + 1 offsets into the texts
+        category_ids, category_starts     categories by id, with the start
+                                          of their questions in the groups
+        name_offsets                      offsets into the category names
+        groups                            question positions grouped by
+                                          category, in listing order
+
+    followed by the UTF-8 question texts, answers and category names.
+"""
+
+
+def _int_array(values=()):
+    return array("i", values)
+
+
+def _texts(values):
+    offsets = _int_array([0])
+    chunks = []
+    for value in values:
+        encoded = (value or "").encode()
+        chunks.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+    return offsets, b"".join(chunks)
+
+
+def _sort_key(row):
+    # NULL sorts first, like models.sort_key() in the database listings
+    _, _, _, category, difficulty = row
+    return (
+        NULL if difficulty is None else difficulty,
+        NULL if category is None else category,
+        row[0],
+    )
+
+
+def build_snapshot(path):
+    """Write the question bank to ``path``, replacing the file atomically.
+
+    Runs inside an application context. Needs fcntl (POSIX). Builds from
+    all workers are serialised by a lock file, so a later build always reads the database
+    after an earlier one and the newest snapshot is the one that stays.
+    """
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        built_at = time.time()
+        categories = (
+            db.session.query(Category.id, Category.type).order_by(Category.id).all()
+        )
+        rows = sorted(question_rows(Question.query).all(), key=_sort_key)
+        db.session.remove()
+
+        ids = _int_array(row[0] for row in rows)
+        question_offsets, question_text = _texts(row[1] for row in rows)
+        answer_offsets, answer_text = _texts(row[2] for row in rows)
+        row_categories = _int_array(NULL if row[3] is None else row[3] for row in rows)
+        difficulties = _int_array(NULL if row[4] is None else row[4] for row in rows)
+
+        positions = {}
+        for position, category in enumerate(row_categories):
+            positions.setdefault(category, []).append(position)
+        category_ids = _int_array(category_id for category_id, _ in categories)
+        category_starts = _int_array([0])
+        groups = _int_array()
+        for category_id in category_ids:
+            groups.extend(positions.get(category_id, ()))
+            category_starts.append(len(groups))
+        name_offsets, names = _texts(name for _, name in categories)
+
+        header = HEADER.pack(
+            MAGIC,
+            built_at,
+            len(rows),
+            len(categories),
+            len(groups),
+            len(question_text),
+            len(answer_text),
+            len(names),
+        )
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as snapshot_file:
+            snapshot_file.write(header.ljust(HEADER_SIZE, b"\0"))
+            for section in (
+                ids,
+                row_categories,
+                difficulties,
+                question_offsets,
+                answer_offsets,
+                category_ids,
+                category_starts,
+                name_offsets,
+                groups,
+            ):
+                snapshot_file.write(section.tobytes())
+            for text in (question_text, answer_text, names):
+                snapshot_file.write(text)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary, path)
+        return len(rows)
+
+
+"""
+QuestionBankSnapshot
+    read-only view of a mapped snapshot file. The arrays are memoryviews
+    into the mapping, so every worker shares the same pages and a question
+    is only decoded when it is served.
+"""
+
+
+class QuestionBankSnapshot:
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._map)
+        (
+            magic,
+            self.built_at,
+            count,
+            category_count,
+            grouped,
+            question_bytes,
+            answer_bytes,
+            name_bytes,
+        ) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("{} is not a question bank snapshot".format(path))
+
+        offset = HEADER_SIZE
+
+        def take(length, fmt="i"):
+            nonlocal offset
+            size = length * (4 if fmt == "i" else 1)
+            section = view[offset : offset + size]
+            offset += size
+            return section.cast(fmt) if fmt == "i" else section
+
+        self.ids = take(count)
+        self.row_categories = take(count)
+        self.difficulties = take(count)
+        self.question_offsets = take(count + 1)
+        self.answer_offsets = take(count + 1)
+        self.category_ids = take(category_count)
+        self.category_starts = take(category_count + 1)
+        self.name_offsets = take(category_count + 1)
+        self.groups = take(grouped)
+        self.question_text = take(question_bytes, "B")
+        self.answer_text = take(answer_bytes, "B")
+        self.names = take(name_bytes, "B")
+
+        self.categories = {
+            category_id: str(
+                self.names[self.name_offsets[index] : self.name_offsets[index + 1]],
+                "utf-8",
+            )
+            for index, category_id in enumerate(self.category_ids)
+        }
+        self._category_index = {
+            category_id: index for index, category_id in enumerate(self.category_ids)
+        }
+
+    def _positions(self, category):
+        """The question positions of ``category`` (None: all) in listing order."""
+        if category is None:
+            return range(len(self.ids))
+        index = self._category_index.get(category)
+        if index is None:
+            return range(0)
+        return self.groups[
+            self.category_starts[index] : self.category_starts[index + 1]
+        ]
+
+    def _sort_key(self, position):
+        return (
+            self.difficulties[position],
+            self.row_categories[position],
+            self.ids[position],
+        )
+
+    def row(self, position):
+        """The question at ``position`` as (id, question, answer, category,
+        difficulty), like queries.question_rows."""
+        category = self.row_categories[position]
+        difficulty = self.difficulties[position]
+        return (
+            self.ids[position],
+            str(
+                self.question_text[
+                    self.question_offsets[position] : self.question_offsets[
+                        position + 1
+                    ]
+                ],
+                "utf-8",
+            ),
+            str(
+                self.answer_text[
+                    self.answer_offsets[position] : self.answer_offsets[position + 1]
+                ],
+                "utf-8",
+            ),
+            None if category == NULL else category,
+            None if difficulty == NULL else difficulty,
+        )
+
+    def total(self, category=None):
+        return len(self._positions(category))
+
+    def page(self, category, after, offset, limit):
+        """Rows of the listing of ``category`` after the sort key ``after``
+        (or from ``offset``), each followed by its sort key like the page
+        queries of paginate_questions."""
+        positions = self._positions(category)
+        start = offset
+        if after is not None:
+            after = tuple(after)
+            low, high = 0, len(positions)
+            while low < high:
+                middle = (low + high) // 2
+                if self._sort_key(positions[middle]) <= after:
+                    low = middle + 1
+                else:
+                    high = middle
+            start = low
+
+        rows = []
+        for position in positions[start : start + limit]:
+            rows.append(self.row(position) + self._sort_key(position))
+        return rows
+
+    def sample(self, category, exclude, count):
+        """Up to ``count`` distinct random questions of ``category`` (None:
+        all) whose ids are not in ``exclude``, as question dicts."""
+        positions = self._positions(category)
+        exclude = set(exclude)
+        picked = {}
+        for _ in range(8 * count):
+            if len(picked) == count or not positions:
+                break
+            position = positions[random.randrange(len(positions))]
+            question_id = self.ids[position]
+            if question_id not in exclude:
+                picked.setdefault(question_id, position)
+
+        if len(picked) < count:
+            # most of the category was played, draw from what is left
+            remaining = [
+                position
+                for position in positions
+                if self.ids[position] not in exclude
+                and self.ids[position] not in picked
+            ]
+            for position in random.sample(
+                remaining, min(count - len(picked), len(remaining))
+            ):
+                picked[self.ids[position]] = position
+
+        return [
+            dict(zip(QUESTION_FIELDS, self.row(position)))
+            for position in picked.values()
+        ]
+
+
+"""
+SnapshotStore
+    snapshot mode, on when SNAPSHOT_PATH is set. current() returns the
+    mapped snapshot, remapping the file when another build replaced it
+    (checked at most every SNAPSHOT_REFRESH_SECONDS); mapping a new file
+    bumps the data version and drops the in-process caches, as the bank
+    may have been changed by another worker.
+
+    A commit in this process makes the snapshot stale for this process, so
+    its reads go to the database until a snapshot built after the commit is
+    mapped, and a session commit wakes a background builder that rebuilds the file after
+    SNAPSHOT_REBUILD_DELAY seconds, coalescing bursts of writes. Other
+    workers keep serving the previous snapshot until then.
+"""
+
+
+class SnapshotStore:
+    def __init__(self):
+        self.path = None
+        self.refresh_seconds = 1.0
+        self.rebuild_delay = 0.5
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked = 0.0
+        self._written_at = 0.0
+        self._rebuild = threading.Event()
+        self._builder = None
+        self._builder_pid = None
+        self._app = None
+
+    def init_app(self, app):
+        self.path = app.config["SNAPSHOT_PATH"] or None
+        if self.path is not None and fcntl is None:
+            raise RuntimeError("snapshot mode needs fcntl, which is POSIX only")
+        self.refresh_seconds = app.config["SNAPSHOT_REFRESH_SECONDS"]
+        self.rebuild_delay = app.config["SNAPSHOT_REBUILD_DELAY"]
+        self._app = app
+        self._snapshot = None
+        self._checked = 0.0
+        self._written_at = 0.0
+
+    def current(self):
+        """The snapshot to serve reads from, or None to use the database."""
+        if self.path is None:
+            return None
+        with self._lock:
+            stale = self._snapshot is None or self._snapshot.built_at < self._written_at
+            now = time.monotonic()
+            if stale or now - self._checked >= self.refresh_seconds:
+                self._checked = now
+                self._refresh()
+            snapshot = self._snapshot
+        if snapshot is None or snapshot.built_at < self._written_at:
+            return None
+        return snapshot
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._request_rebuild()
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._snapshot is not None and self._snapshot.key == key:
+            return
+        self._snapshot = QuestionBankSnapshot(self.path)
+        data_version.bump()
+        question_counts.reset()
+        category_cache.invalidate()
+
+    def wrote(self, connection):
+        # the commit event comes before the database commits: from here
+        # on the mapped snapshot is stale for this process
+        if self.path is None:
+            return
+        self._written_at = time.time()
+
+    def committed(self, session):
+        # a build that started before the commit landed may still have read
+        # the old rows, only a snapshot built after now is current
+        if self.path is None:
+            return
+        self._written_at = time.time()
+        self._request_rebuild()
+
+    def _request_rebuild(self):
+        # threads do not survive a fork, each worker starts its own builder
+        if self._builder_pid != os.getpid() or not self._builder.is_alive():
+            self._builder_pid = os.getpid()
+            self._builder = threading.Thread(
+                target=self._build_forever, name="snapshot-builder", daemon=True
+            )
+            self._builder.start()
+        self._rebuild.set()
+
+    def _build_forever(self):
+        while True:
+            self._rebuild.wait()
+            time.sleep(self.rebuild_delay)
+            self._rebuild.clear()
+            if self.path is None:
+                continue
+            try:
+                with self._app.app_context():
+                    build_snapshot(self.path)
+            except Exception:
+                logger.exception("rebuilding the question bank snapshot failed")
+
+
+snapshots = SnapshotStore()
+
+
+@event.listens_for(Engine, "commit")
+def _on_commit(connection):
+    snapshots.wrote(connection)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    snapshots.committed(session)
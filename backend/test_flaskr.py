@@ -1,10 +1,26 @@
+import asyncio
+import base64
 import os
+import random
+import tempfile
+import threading
+import time
 import unittest
 import json
+from flask_migrate import upgrade
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+from asgi import TriviaASGI, open_database
+from flaskr import QUESTIONS_PER_PAGE, create_app, random_questions
+from json_backend import orjson
+from models import setup_db, db, Question, Category
+from query_budget import query_budget
+from quiz_sessions import QuizSessionStore
+from replicas import WRITE_COOKIE, replicas
+from response_cache import ResponseCache
+from snapshot import build_snapshot, snapshots
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -39,7 +55,8 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_get_categories(self):
         """Test getting categories"""
-        res = self.client().get("/categories")
+        with query_budget(max_queries=1, max_rows=10):
+            res = self.client().get("/categories")
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -47,6 +64,78 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["total_categories"])
         self.assertTrue(len(data["categories"]))
 
+    def test_get_categories_after_category_insert(self):
+        """Test that a new category invalidates the cached categories"""
+        self.client().get("/categories")
+        with self.app.app_context():
+            category = Category(type="Music")
+            category.insert()
+            category_id = category.id
+
+        res = self.client().get("/categories")
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["categories"][str(category_id)], "Music")
+
+    def test_304_if_categories_not_modified(self):
+        first = self.client().get("/categories")
+        res = self.client().get(
+            "/categories", headers={"If-None-Match": first.headers["ETag"]}
+        )
+
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.headers["Last-Modified"])
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], first.headers["ETag"])
+
+    def test_200_if_modified_in_the_same_second(self):
+        first = self.client().get("/categories")
+        self.client().post(
+            "/questions",
+            json={"question": "Same second?", "answer": "yes", "category": 1},
+        )
+        res = self.client().get(
+            "/categories",
+            headers={"If-Modified-Since": first.headers["Last-Modified"]},
+        )
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_etag_changes_after_question_write(self):
+        first = self.client().get("/questions")
+        self.client().post(
+            "/questions",
+            json={
+                "question": "How many legs does a spider have?",
+                "answer": "Eight",
+                "category": 1,
+                "difficulty": 1,
+            },
+        )
+        res = self.client().get(
+            "/questions", headers={"If-None-Match": first.headers["ETag"]}
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], first.headers["ETag"])
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_json_backends_return_same_documents(self):
+        responses = {}
+        for backend in ("stdlib", "orjson"):
+            app = create_app({"JSON_BACKEND": backend})
+            setup_db(app, self.database_path)
+            responses[backend] = app.test_client().get("/questions?page=2")
+
+        self.assertEqual(
+            json.loads(responses["orjson"].data), json.loads(responses["stdlib"].data)
+        )
+        self.assertEqual(responses["orjson"].mimetype, "application/json")
+
     def test_404_if_category_not_found(self):
         res = self.client().post(
             "/question", json={"question": 4353, "answer": True, "category": "3"}
@@ -59,7 +148,9 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_get_questions(self):
         """Test getting categories"""
-        res = self.client().get("/questions")
+        # one page, the categories and the per-category counts
+        with query_budget(max_queries=3, max_rows=25):
+            res = self.client().get("/questions")
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -69,6 +160,136 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["current_category"], None)
         self.assertTrue(len(data["categories"]))
 
+    def test_get_questions_with_cursor(self):
+        """Test that the cursor continues where the first page stopped"""
+        first_page = json.loads(self.client().get("/questions").data)
+        res = self.client().get(
+            "/questions?cursor={}".format(first_page["next_cursor"])
+        )
+        data = json.loads(res.data)
+        second_page = json.loads(self.client().get("/questions?page=2").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(first_page["next_cursor"])
+        self.assertEqual(
+            [question["id"] for question in data["questions"]],
+            [question["id"] for question in second_page["questions"]],
+        )
+
+    def test_400_if_questions_cursor_is_invalid(self):
+        res = self.client().get("/questions?cursor=not-a-cursor")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "bad request")
+
+    def test_cursor_reaches_questions_without_difficulty_or_category(self):
+        # more than a page of them, so a cursor ends on a NULL difficulty
+        created = [
+            self.client()
+            .post("/questions", json={"question": "Blank {}?".format(n), "answer": "a"})
+            .get_json()["created"]
+            for n in range(QUESTIONS_PER_PAGE + 1)
+        ]
+        created.append(
+            self.client()
+            .post(
+                "/questions",
+                json={"question": "No category?", "answer": "b", "difficulty": 3},
+            )
+            .get_json()["created"]
+        )
+        seen = []
+        data = json.loads(self.client().get("/questions").data)
+        while True:
+            seen.extend(question["id"] for question in data["questions"])
+            if not data["next_cursor"]:
+                break
+            res = self.client().get("/questions?cursor=" + data["next_cursor"])
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data)
+
+        self.assertEqual(len(seen), data["total_questions"])
+        self.assertEqual(len(set(seen)), len(seen))
+        self.assertTrue(set(created) <= set(seen))
+
+    def test_400_if_questions_cursor_is_tampered(self):
+        cursor = base64.urlsafe_b64encode(b'["a", null, 1]').decode()
+        res = self.client().get("/questions?cursor=" + cursor)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "bad request")
+
+    def test_cached_questions_refresh_after_delete(self):
+        first = json.loads(self.client().get("/questions").data)
+        cached = json.loads(self.client().get("/questions").data)
+        question_id = first["questions"][0]["id"]
+        self.client().delete("/questions/{}".format(question_id))
+        res = self.client().get("/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(cached, first)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], first["total_questions"] - 1)
+        self.assertNotIn(
+            question_id, [question["id"] for question in data["questions"]]
+        )
+
+    def test_query_budget_fails_table_reads(self):
+        with self.app.app_context():
+            with self.assertRaises(AssertionError) as failure:
+                with query_budget(max_rows=5):
+                    Question.query.all()
+
+            with query_budget(max_queries=1, max_rows=1) as recorder:
+                Question.query.first()
+
+        self.assertIn("rows fetched, budget is 5", str(failure.exception))
+        self.assertEqual(recorder.queries, 1)
+        self.assertEqual(recorder.rows, 1)
+
+    def test_response_cache_coalesces_concurrent_misses(self):
+        cache = ResponseCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return "page", 4, True
+
+        threads = [
+            threading.Thread(target=cache.get_or_compute, args=("key", compute))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get_or_compute("key", compute), "page")
+
+    def test_response_cache_entries_expire(self):
+        now = [0.0]
+        cache = ResponseCache(max_age=5, clock=lambda: now[0])
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return "page", 4, True
+
+        cache.get_or_compute("key", compute)
+        now[0] = 4.9
+        cache.get_or_compute("key", compute)
+        now[0] = 5.0
+        cache.get_or_compute("key", compute)
+
+        self.assertEqual(len(calls), 2)
+
     def test_404_if_question_not_found(self):
         res = self.client().get("/question")
         data = json.loads(res.data)
@@ -79,7 +300,8 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_delete_question(self):
         """Test delete question"""
-        res = self.client().delete("/questions/9")
+        with query_budget(max_queries=4, max_rows=20):
+            res = self.client().delete("/questions/9?include_questions=true")
         data = json.loads(res.data)
 
         question = Question.query.filter(Question.id == 9).one_or_none()
@@ -109,12 +331,31 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_create_new_questions(self):
         """Test create new question"""
+        with query_budget(max_queries=4, max_rows=20):
+            res = self.client().post(
+                "/questions?include_questions=true",
+                json={
+                    "question": "Elon Musk's dog's name?",
+                    "answer": "flukky",
+                    "category": 5,
+                },
+            )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(data["created"])
+        self.assertTrue(data["total_questions"])
+        self.assertTrue(len(data["questions"]))
+
+    def test_create_question_acknowledges_without_questions(self):
         res = self.client().post(
             "/questions",
             json={
-                "question": "Elon Musk's dog's name?",
-                "answer": "flukky",
-                "category": 5,
+                "question": "What is the largest ocean?",
+                "answer": "Pacific",
+                "category": 3,
+                "difficulty": 1,
             },
         )
         data = json.loads(res.data)
@@ -123,7 +364,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["created"])
         self.assertTrue(data["total_questions"])
-        self.assertTrue(len(data["questions"]))
+        self.assertNotIn("questions", data)
+
+    def test_total_questions_follows_create(self):
+        """Test that the cached total counts a newly created question"""
+        before = json.loads(self.client().get("/questions").data)
+        res = self.client().post(
+            "/questions",
+            json={
+                "question": "Which planet is known as the red planet?",
+                "answer": "Mars",
+                "category": 1,
+                "difficulty": 1,
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], before["total_questions"] + 1)
 
     def test_400_error_for_create_new_questions(self):
         """Test getting categories"""
@@ -154,8 +412,116 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "resource not found")
 
+    def test_import_questions(self):
+        before = json.loads(self.client().get("/questions").data)
+        body = "\n".join(
+            [
+                json.dumps(
+                    {
+                        "question": "What is the chemical symbol for gold?",
+                        "answer": "Au",
+                        "category": 1,
+                        "difficulty": 2,
+                    }
+                ),
+                json.dumps({"question": "Missing answer", "category": 1}),
+                "not json",
+            ]
+        )
+        res = self.client().post(
+            "/questions/import", data=body, content_type="application/x-ndjson"
+        )
+        data = json.loads(res.data)
+        after = json.loads(self.client().get("/questions").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["imported"], 1)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual([error["row"] for error in data["errors"]], [2, 3])
+        self.assertEqual(after["total_questions"], before["total_questions"] + 1)
+
+    def test_import_questions_from_csv(self):
+        body = "question,answer,category,difficulty\nWho painted the Mona Lisa?,Leonardo,2,1\n"
+        res = self.client().post(
+            "/questions/import", data=body, content_type="text/csv"
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["imported"], 1)
+        self.assertEqual(data["failed"], 0)
+
+    def test_import_questions_reports_undecodable_rows(self):
+        body = (
+            b"question,answer,category,difficulty\n"
+            b"Caf\xe9?,Latte,2,1\n"
+            b"\xff\xfe,No,2,1\n"
+            b"Who painted the Mona Lisa?,Leonardo,2,1\n"
+        )
+        res = self.client().post(
+            "/questions/import", data=body, content_type="text/csv"
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["imported"], 1)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual([error["row"] for error in data["errors"]], [1, 2])
+
+        res = self.client().post(
+            "/questions/import",
+            data=b'{"question": "Caf\xe9?", "answer": "Latte", "category": 2}\n',
+            content_type="application/x-ndjson",
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["failed"], 1)
+        self.assertIn("UTF-8", data["errors"][0]["error"])
+
+    def test_415_import_questions_unsupported_type(self):
+        res = self.client().post(
+            "/questions/import", data="question", content_type="text/plain"
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unsupported media type")
+
+    def test_export_questions(self):
+        res = self.client().get("/questions/export?category=5")
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        category = json.loads(self.client().get("/categories/5/questions").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertEqual(len(rows), category["total_questions"])
+        self.assertEqual([row["id"] for row in rows], sorted(row["id"] for row in rows))
+
+    def test_export_categories_as_csv(self):
+        res = self.client().get("/categories/export?format=csv")
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/csv")
+        self.assertEqual(lines[0], "id,type")
+        self.assertTrue(len(lines) > 1)
+
+    def test_400_export_questions_unknown_format(self):
+        res = self.client().get("/questions/export?format=xml")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "bad request")
+
     def test_search_for_question_with_result(self):
-        res = self.client().post("/questions/search", json={"searchTerm": "india"})
+        # the first search builds the in-process index when pg_trgm is missing
+        self.client().post("/questions/search", json={"searchTerm": "title"})
+        with query_budget(max_queries=2, max_rows=12):
+            res = self.client().post("/questions/search", json={"searchTerm": "india"})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -172,6 +538,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["total_questions"], 0)
         self.assertEqual(len(data["questions"]), 0)
 
+    def test_search_treats_wildcards_literally(self):
+        res = self.client().post("/questions/search", json={"searchTerm": "%"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["total_questions"], 0)
+        self.assertEqual(len(data["questions"]), 0)
+
     def test_error_400_search_for_question_without_search_item(self):
         res = self.client().post("/questions")
         data = json.loads(res.data)
@@ -181,7 +556,8 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "bad request")
 
     def test_retieve_question_by_category(self):
-        res = self.client().get("/categories/5/questions")
+        with query_budget(max_queries=3, max_rows=25):
+            res = self.client().get("/categories/5/questions")
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -202,7 +578,11 @@ class TriviaTestCase(unittest.TestCase):
             "previous_questions": [23, 12],
             "quiz_category": {"type": "History", "id": 4},
         }
-        res = self.client().post("/quizzes", json=new_quiz)
+        # once the ids are loaded they are drawn in process, only the
+        # question is read
+        self.client().post("/quizzes", json=new_quiz)
+        with query_budget(max_queries=1, max_rows=1):
+            res = self.client().post("/quizzes", json=new_quiz)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
@@ -210,6 +590,90 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["previous_questions"])
         self.assertTrue(data["question"])
 
+    def test_play_quiz_returns_only_unseen_question(self):
+        category = json.loads(self.client().get("/categories/4/questions").data)
+        ids = [question["id"] for question in category["questions"]]
+        new_quiz = {
+            "previous_questions": ids[:-1],
+            "quiz_category": {"type": "History", "id": 4},
+        }
+        res = self.client().post("/quizzes", json=new_quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["id"], ids[-1])
+
+    def test_random_questions_are_uniform_within_the_selection(self):
+        category = json.loads(self.client().get("/categories/4/questions").data)
+        ids = [question["id"] for question in category["questions"]]
+        random.seed(4)
+        with self.app.app_context():
+            picks = [random_questions(4, [])[0]["id"] for _ in range(400)]
+
+        # ids 5, 9, 12 and 23: picking by id gaps chose 23 half of the time
+        expected = len(picks) / len(ids)
+        for question_id in ids:
+            self.assertLess(abs(picks.count(question_id) - expected), expected / 3)
+
+    def test_random_questions_skip_questions_deleted_elsewhere(self):
+        with self.app.app_context():
+            question = Question("Deleted elsewhere?", "yes", 4, 1)
+            question.insert()
+            question_id = question.id
+            # another worker's delete does not reach this process' id arrays
+            db.session.execute(
+                Question.__table__.delete().where(Question.id == question_id)
+            )
+            db.session.commit()
+            picks = random_questions(4, [], count=10)
+            left = Question.query.filter(Question.category == 4).count()
+
+        self.assertNotIn(question_id, [pick["id"] for pick in picks])
+        self.assertEqual(len(picks), left)
+
+    def test_play_quiz_prefetches_unseen_questions(self):
+        category = json.loads(self.client().get("/categories/4/questions").data)
+        ids = [question["id"] for question in category["questions"]]
+        new_quiz = {
+            "previous_questions": ids[:1],
+            "quiz_category": {"type": "History", "id": 4},
+            "count": 5,
+        }
+        with query_budget(max_queries=2, max_rows=30):
+            res = self.client().post("/quizzes", json=new_quiz)
+        data = json.loads(res.data)
+        picked = [question["id"] for question in data["questions"]]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(sorted(picked), sorted(ids[1:]))
+        self.assertEqual(data["question"]["id"], picked[0])
+
+    def test_422_play_quiz_count_out_of_range(self):
+        new_quiz = {
+            "previous_questions": [],
+            "quiz_category": {"type": "History", "id": 4},
+            "count": 0,
+        }
+        res = self.client().post("/quizzes", json=new_quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unprocessable")
+
+    def test_play_quiz_with_string_category_id(self):
+        new_quiz = {
+            "previous_questions": [],
+            "quiz_category": {"type": "History", "id": "4"},
+        }
+        res = self.client().post("/quizzes", json=new_quiz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["category"], 4)
+
     def test_play_quiz_without_quiz_category(self):
         new_quiz = {"previous_questions": [23, 12]}
         res = self.client().post("/quizzes", json=new_quiz)
@@ -265,6 +729,474 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "method not allowed")
 
+    def test_play_quiz_session(self):
+        start = {"quiz_category": {"type": "History", "id": 4}}
+        self.client().post("/quizzes/sessions", json=start)
+        # the deck is drawn from the loaded id arrays, nothing is read
+        with query_budget(max_queries=0, max_rows=0):
+            res = self.client().post("/quizzes/sessions", json=start)
+        session = json.loads(res.data)
+
+        asked = []
+        for _ in range(session["total_questions"]):
+            with query_budget(max_queries=1, max_rows=1):
+                res_next = self.client().post(
+                    "/quizzes/sessions/{}/next".format(session["session_id"])
+                )
+            data = json.loads(res_next.data)
+            asked.append(data["question"]["id"])
+        last = self.client().post(
+            "/quizzes/sessions/{}/next".format(session["session_id"])
+        )
+        data = json.loads(last.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(session["session_id"])
+        self.assertTrue(session["total_questions"])
+        self.assertEqual(len(set(asked)), session["total_questions"])
+        self.assertEqual(last.status_code, 200)
+        self.assertEqual(data["question"], None)
+        self.assertEqual(data["remaining"], 0)
+
+    def test_quiz_session_deck_is_capped(self):
+        store = QuizSessionStore(max_deck=3)
+        session = store.create({"id": 0}, range(1, 11))
+
+        self.assertEqual(len(session.deck), 3)
+        self.assertEqual(session.deck.typecode, "i")
+        self.assertTrue(set(session.deck) <= set(range(1, 11)))
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post("/quizzes/sessions/unknown/next")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "resource not found")
+
+    def test_404_end_quiz_session_not_found(self):
+        res = self.client().delete("/quizzes/sessions/unknown")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "resource not found")
+
+    def test_asgi_serves_same_documents(self):
+        try:
+            database = open_database(
+                self.app.config["SQLALCHEMY_DATABASE_URI"], self.app.config
+            )
+        except RuntimeError as error:
+            self.skipTest(str(error))
+        asgi_app = TriviaASGI(self.app, database)
+        statements = []
+        fetch = database._fetch
+
+        async def counted_fetch(sql, params):
+            statements.append(sql)
+            return await fetch(sql, params)
+
+        database._fetch = counted_fetch
+
+        async def get(path, query_string=b""):
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": query_string,
+                "headers": [],
+            }
+            await asgi_app(scope, receive, send)
+            return messages[0]["status"], b"".join(
+                message.get("body", b"") for message in messages[1:]
+            )
+
+        async def requests():
+            try:
+                return [
+                    await get("/questions", b"page=2"),
+                    await get("/categories/4/questions"),
+                    await get("/categories/999/questions"),
+                    await get("/questions/export"),
+                ]
+            finally:
+                await database.close()
+
+        responses = asyncio.run(requests())
+        expected = [
+            self.client().get("/questions?page=2"),
+            self.client().get("/categories/4/questions"),
+            self.client().get("/categories/999/questions"),
+            self.client().get("/questions/export"),
+        ]
+
+        self.assertEqual(responses, [(res.status_code, res.data) for res in expected])
+        # totals and categories come from the caches, only the pages are read
+        self.assertEqual(len(statements), 2)
+
+    def test_migrations_upgrade_an_empty_database(self):
+        path = os.path.join(tempfile.mkdtemp(), "trivia.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///{}".format(path)})
+        migrations = os.path.join(os.path.dirname(__file__), "migrations")
+        with app.app_context():
+            upgrade(directory=migrations)
+            indexes = {
+                name
+                for (name,) in db.session.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index'"
+                )
+            }
+
+        self.assertIn("ix_questions_listing", indexes)
+        self.assertIn("ix_questions_category_listing", indexes)
+        self.assertNotIn("ix_questions_difficulty_category_id", indexes)
+
+    def test_reads_use_replica_until_client_writes(self):
+        replica_path = os.path.join(tempfile.mkdtemp(), "replica.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": self.app.config["SQLALCHEMY_DATABASE_URI"],
+                "DB_REPLICA_URLS": "sqlite:///{}".format(replica_path),
+                "RESPONSE_CACHE_ENTRIES": 0,
+            }
+        )
+        # a SQLite file with a single question stands in for the replica
+        replica = replicas.engines[0]
+        db.Model.metadata.create_all(replica)
+        replica.execute(
+            Category.__table__.insert(), [{"id": 5, "type": "Entertainment"}]
+        )
+        replica.execute(
+            Question.__table__.insert(),
+            [{"question": "Replica?", "answer": "yes", "category": 5, "difficulty": 1}],
+        )
+        client = app.test_client()
+
+        before = json.loads(client.get("/questions").data)
+        res = client.post(
+            "/questions",
+            json={
+                "question": "Which ocean is the deepest?",
+                "answer": "Pacific",
+                "category": 3,
+                "difficulty": 2,
+            },
+        )
+        after = json.loads(client.get("/questions").data)
+
+        self.assertEqual(
+            [question["question"] for question in before["questions"]], ["Replica?"]
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(WRITE_COOKIE, res.headers["Set-Cookie"])
+        self.assertNotIn(
+            "Replica?", [question["question"] for question in after["questions"]]
+        )
+        self.assertEqual(after["total_questions"], res.get_json()["total_questions"])
+
+    def test_snapshot_mode_serves_reads_from_file(self):
+        snapshot_path = os.path.join(tempfile.mkdtemp(), "bank.snapshot")
+        config = {
+            "SQLALCHEMY_DATABASE_URI": self.app.config["SQLALCHEMY_DATABASE_URI"],
+            "RESPONSE_CACHE_ENTRIES": 0,
+        }
+        database_pages = [
+            json.loads(self.client().get(path).data)
+            for path in ("/questions", "/questions?page=2", "/categories/4/questions")
+        ]
+        app = create_app(
+            dict(
+                config,
+                SNAPSHOT_PATH=snapshot_path,
+                SNAPSHOT_REFRESH_SECONDS=0,
+                SNAPSHOT_REBUILD_DELAY=0,
+            )
+        )
+        with app.app_context():
+            build_snapshot(snapshot_path)
+        client = app.test_client()
+
+        with query_budget(max_queries=0):
+            snapshot_pages = [
+                json.loads(client.get(path).data)
+                for path in (
+                    "/questions",
+                    "/questions?page=2",
+                    "/categories/4/questions",
+                )
+            ]
+            following = json.loads(
+                client.get("/questions?cursor=" + snapshot_pages[0]["next_cursor"]).data
+            )
+            quiz = json.loads(
+                client.post(
+                    "/quizzes",
+                    json={
+                        "previous_questions": [],
+                        "quiz_category": {"type": "Art", "id": 2},
+                        "count": 3,
+                    },
+                ).data
+            )
+
+        self.assertEqual(snapshot_pages, database_pages)
+        self.assertEqual(following["questions"], database_pages[1]["questions"])
+        self.assertEqual(len(quiz["questions"]), 3)
+        self.assertTrue(
+            all(question["category"] == 2 for question in quiz["questions"])
+        )
+
+        res = client.post(
+            "/questions",
+            json={
+                "question": "Which planet is the largest?",
+                "answer": "Jupiter",
+                "category": 1,
+                "difficulty": 1,
+            },
+        )
+        total = res.get_json()["total_questions"]
+        # the write is read back from the database until the file is rebuilt
+        self.assertEqual(
+            json.loads(client.get("/questions").data)["total_questions"], total
+        )
+        deadline = time.monotonic() + 10
+        while snapshots.current() is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with query_budget(max_queries=0):
+            data = json.loads(client.get("/questions").data)
+        self.assertEqual(data["total_questions"], total)
+
+    def test_write_batching_groups_concurrent_writes(self):
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": self.app.config["SQLALCHEMY_DATABASE_URI"],
+                "WRITE_BATCH_ENABLED": True,
+                "WRITE_BATCH_WINDOW_MS": 100,
+            }
+        )
+
+        def concurrently(requests):
+            results = [None] * len(requests)
+            start = threading.Barrier(len(requests))
+
+            def send(index, method, path, body):
+                client = app.test_client()
+                start.wait()
+                results[index] = getattr(client, method)(path, json=body)
+
+            threads = [
+                threading.Thread(target=send, args=(index,) + request)
+                for index, request in enumerate(requests)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return results
+
+        commits = []
+
+        def count_commit(connection):
+            commits.append(connection)
+
+        question = {"answer": "batched", "category": 1, "difficulty": 1}
+        event.listen(Engine, "commit", count_commit)
+        try:
+            created = concurrently(
+                [
+                    (
+                        "post",
+                        "/questions",
+                        dict(question, question="Batch {}?".format(n)),
+                    )
+                    for n in range(6)
+                ]
+            )
+        finally:
+            event.remove(Engine, "commit", count_commit)
+        ids = [res.get_json()["created"] for res in created]
+
+        # a write that cannot be bound fails alone, its neighbour commits
+        bad, good = concurrently(
+            [
+                ("post", "/questions", dict(question, question={"not": "text"})),
+                ("post", "/questions", dict(question, question="Batch 6?")),
+            ]
+        )
+        ids.append(good.get_json()["created"])
+        deleted = concurrently(
+            [("delete", "/questions/{}".format(id), None) for id in ids]
+        )
+        again = app.test_client().delete("/questions/{}".format(ids[0]))
+
+        self.assertEqual([res.status_code for res in created], [200] * 6)
+        self.assertEqual(len(set(ids)), 7)
+        self.assertLess(len(commits), 6)
+        self.assertEqual(bad.status_code, 422)
+        self.assertEqual(good.status_code, 200)
+        self.assertEqual([res.get_json()["deleted"] for res in deleted], ids)
+        self.assertEqual(again.status_code, 422)
+
+    def test_suggest_questions_by_word_prefix(self):
+        with query_budget(max_queries=0):
+            res = self.client().get("/questions/suggest?prefix=Penic")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["prefix"], "Penic")
+        self.assertTrue(
+            all("penic" in item["question"].lower() for item in data["suggestions"])
+        )
+        self.assertIn(
+            "Who discovered penicillin?",
+            [item["question"] for item in data["suggestions"]],
+        )
+
+    def test_suggestions_follow_inserts_and_deletes(self):
+        created = self.client().post(
+            "/questions",
+            json={
+                "question": "Which quokkas live on Rottnest Island?",
+                "answer": "All of them",
+                "category": 1,
+                "difficulty": 1,
+            },
+        )
+        question_id = created.get_json()["created"]
+        found = self.client().get("/questions/suggest?prefix=quokk").get_json()
+        self.client().delete("/questions/{}".format(question_id))
+        gone = self.client().get("/questions/suggest?prefix=quokk").get_json()
+
+        self.assertEqual(
+            found["suggestions"],
+            [{"id": question_id, "question": "Which quokkas live on Rottnest Island?"}],
+        )
+        self.assertEqual(gone["suggestions"], [])
+
+    def test_suggestions_skip_rolled_back_inserts(self):
+        with self.app.app_context():
+            db.session.add(Question("Which wombats were rolled back?", "a", 1, 1))
+            db.session.flush()
+            db.session.rollback()
+        res = self.client().get("/questions/suggest?prefix=wombat").get_json()
+
+        self.assertEqual(res["suggestions"], [])
+
+    def test_422_suggest_without_prefix(self):
+        res = self.client().get("/questions/suggest?prefix=%20")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unprocessable")
+
+    def test_batch_answers_like_the_routes(self):
+        requests = [
+            {"method": "GET", "path": "/questions?page=2"},
+            {"method": "GET", "path": "/categories"},
+            {
+                "method": "POST",
+                "path": "/questions/search",
+                "body": {"searchTerm": "title"},
+            },
+            {"path": "/categories/1000/questions"},
+        ]
+        expected = [
+            self.client().get("/questions?page=2"),
+            self.client().get("/categories"),
+            self.client().post("/questions/search", json={"searchTerm": "title"}),
+            self.client().get("/categories/1000/questions"),
+        ]
+
+        for parallel in (False, True):
+            res = self.client().post(
+                "/batch", json={"requests": requests, "parallel": parallel}
+            )
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data["success"], True)
+            self.assertEqual(
+                data["responses"],
+                [
+                    {"status": direct.status_code, "body": direct.get_json()}
+                    for direct in expected
+                ],
+            )
+
+    def test_batch_reads_after_a_failed_write(self):
+        requests = [
+            {
+                "method": "POST",
+                "path": "/questions",
+                "body": {"question": ["not", "text"], "answer": "a", "category": 1},
+            },
+            {"path": "/questions"},
+            {"path": "/categories/1/questions"},
+        ]
+
+        for parallel in (False, True):
+            res = self.client().post(
+                "/batch", json={"requests": requests, "parallel": parallel}
+            )
+            data = json.loads(res.data)
+
+            self.assertEqual(
+                [item["status"] for item in data["responses"]], [422, 200, 200]
+            )
+
+    def test_422_batch_with_nested_batch(self):
+        res = self.client().post(
+            "/batch",
+            json={"requests": [{"method": "POST", "path": "/batch", "body": {}}]},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "unprocessable")
+
+    def test_get_pool_stats(self):
+        self.client().get("/questions")
+        res = self.client().get("/stats/pool")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["pool"]["pool"], "MeteredQueuePool")
+        self.assertTrue(data["pool"]["checkouts"])
+        self.assertEqual(data["pool"]["pid"], os.getpid())
+
+    def test_get_metrics(self):
+        self.client().get("/questions")
+        res = self.client().get("/metrics")
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_request_duration_seconds_count{endpoint="/questions",method="GET"} 1',
+            text,
+        )
+        self.assertIn(
+            'trivia_requests_total{endpoint="/questions",method="GET",status="200"} 1',
+            text,
+        )
+        self.assertIn(
+            'trivia_sql_statements_total{endpoint="/questions",method="GET"}', text
+        )
+        self.assertIn("trivia_db_pool_checkouts_total", text)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from models import db, Question, data_version, question_counts
+from replicas import replicas
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+        self.future = Future()
+
+
+"""
+WriteBatcher
+    group commit for the question writes of create_question and
+    delete_question, on when WRITE_BATCH_ENABLED is set. Callers queue
+    their insert or delete and wait; a writer thread takes the first queued
+    write, collects more for up to WRITE_BATCH_WINDOW_MS or until
+    WRITE_BATCH_MAX are queued, and applies them in one flush and one
+    commit, so a burst of writes waits for one fsync instead of one each.
+
+    Every caller gets its own result back: the id of its new question, or
+    whether its question existed. When the grouped transaction fails, the
+    writes are retried one transaction each, so only the writes that fail
+    on their own report an error.
+"""
+
+
+class WriteBatcher:
+    def __init__(self):
+        self.enabled = False
+        self.max_batch = 64
+        self.window = 0.002
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app):
+        self.enabled = app.config["WRITE_BATCH_ENABLED"]
+        self.max_batch = max(1, app.config["WRITE_BATCH_MAX"])
+        self.window = app.config["WRITE_BATCH_WINDOW_MS"] / 1000
+        self._app = app
+
+    def insert(self, **fields):
+        """Queue a new question and return its id once committed."""
+        return self._submit(_Write("insert", fields))
+
+    def delete(self, question_id):
+        """Queue the delete of a question; False when it does not exist."""
+        return self._submit(_Write("delete", question_id))
+
+    def _submit(self, write):
+        self._start()
+        self._queue.put(write)
+        result = write.future.result()
+        # the commit ran on the writer thread, record it for this request
+        replicas.note_write()
+        return result
+
+    def _start(self):
+        # threads do not survive a fork, each worker starts its own writer
+        with self._lock:
+            if self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._writer_pid = os.getpid()
+            self._writer = threading.Thread(
+                target=self._write_forever, name="write-batcher", daemon=True
+            )
+            self._writer.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_forever(self):
+        while True:
+            batch = self._collect()
+            try:
+                with self._app.app_context():
+                    self._write(batch)
+            except Exception as error:
+                logger.exception("writing a batch of %d questions failed", len(batch))
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(error)
+
+    def _write(self, batch):
+        try:
+            results = self._apply(batch)
+        except Exception:
+            db.session.rollback()
+            if len(batch) == 1:
+                raise
+            # find the writes that fail on their own
+            for write in batch:
+                try:
+                    self._write([write])
+                except Exception as error:
+                    write.future.set_exception(error)
+            return
+        finally:
+            db.session.remove()
+
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+    def _apply(self, batch):
+        """Apply ``batch`` in one transaction and return one result per write."""
+        deleted_ids = [write.value for write in batch if write.kind == "delete"]
+        existing = {}
+        if deleted_ids:
+            existing = {
+                question.id: question
+                for question in Question.query.filter(Question.id.in_(deleted_ids))
+            }
+
+        changes = []
+        for write in batch:
+            if write.kind == "insert":
+                question = Question(**write.value)
+                db.session.add(question)
+                changes.append((question, 1))
+            else:
+                # a question deleted twice in one batch only counts once
+                question = existing.pop(write.value, None)
+                if question is not None:
+                    db.session.delete(question)
+                changes.append((question, -1))
+        db.session.flush()
+        counted = [
+            (question.category, question.id, delta)
+            for question, delta in changes
+            if question is not None
+        ]
+        results = [
+            question.id if delta > 0 else question is not None
+            for question, delta in changes
+        ]
+        db.session.commit()
+
+        for category, question_id, delta in counted:
+            if delta > 0:
+                question_counts.added(category, question_id)
+            else:
+                question_counts.removed(category, question_id)
+        data_version.bump()
+        return results
+
+
+write_batcher = WriteBatcher()
@@ -1,8 +1,10 @@
 import React, { Component } from 'react';
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   };
 
   getInfo = (event) => {
@@ -14,6 +16,29 @@ class Search extends Component {
     this.setState({
       query: this.search.value,
     });
+    this.getSuggestions(this.search.value);
+  };
+
+  getSuggestions = (prefix) => {
+    if (!prefix.trim()) {
+      this.setState({ suggestions: [] });
+      return;
+    }
+    $.ajax({
+      url: `/questions/suggest?prefix=${encodeURIComponent(prefix)}`,
+      type: 'GET',
+      success: (result) => {
+        // keystrokes can overtake each other, keep the latest prefix only
+        if (prefix === this.state.query) {
+          this.setState({ suggestions: result.suggestions });
+        }
+        return;
+      },
+      error: (error) => {
+        this.setState({ suggestions: [] });
+        return;
+      },
+    });
   };
 
   render() {
@@ -23,7 +48,13 @@ class Search extends Component {
           placeholder='Search questions...'
           ref={(input) => (this.search = input)}
           onChange={this.handleInputChange}
+          list='question-suggestions'
         />
+        <datalist id='question-suggestions'>
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion.id} value={suggestion.question} />
+          ))}
+        </datalist>
         <input type='submit' value='Submit' className='button' />
       </form>
     );